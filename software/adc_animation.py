@@ -8,11 +8,13 @@ It reads data from a CSV file and displays it in a GUI with multiple subplots.
 #!/usr/bin/env python
 import sys
 import os
-import collections
 import signal
+import numpy as np
 import pandas as pd
 from PyQt5 import QtWidgets, QtCore
 import pyqtgraph as pg
+from trace_buffer import TraceBuffer
+from decimation import MinMaxDecimator
 
 # ------------------------------
 # Determine data folder
@@ -38,14 +40,21 @@ pg.setConfigOption('antialias', True)
 pg.setConfigOption('background', 'w')
 pg.setConfigOption('foreground', 'k')
 
-# Data storage: 8 groups, 3 traces per group.
-data = [[collections.deque(maxlen=5000) for _ in range(3)] for _ in range(8)]
+# Data storage: 8 groups, 3 traces per group, plus the matching timestamps.
+MAX_POINTS = 5000
+data = TraceBuffer(8, 3, MAX_POINTS)
+times = TraceBuffer(1, 1, MAX_POINTS, dtype=np.float64)
+decimator = MinMaxDecimator(data)
 
 # Load CSV data.
 # Expected CSV header:
 # Time (s),G0_Short,G0_Long1,G0_Long2,G0_Emitter,...,G7_Short,G7_Long1,G7_Long2,G7_Emitter
 df = pd.read_csv(CSV_PATH)
 n_rows = df.shape[0]
+# Short, Long1, Long2 of every group as an (n_rows, 8, 3) array (Emitter ignored).
+reading_cols = [f"G{i}_{name}" for i in range(8) for name in ("Short", "Long1", "Long2")]
+readings = df[reading_cols].to_numpy(dtype=np.float32).reshape(n_rows, 8, 3)
+time_values = df["Time (s)"].to_numpy(dtype=np.float64)
 
 # ------------------------------
 # Set Up PyQt Application & UI
@@ -109,23 +118,16 @@ def update():
     """
     global CURRENT_INDEX
     if CURRENT_INDEX < n_rows:
-        row = df.iloc[CURRENT_INDEX]
-        # For each group, extract Short, Long1, Long2 (ignore Emitter)
-        for i in range(8):
-            group_values = [
-                row[f"G{i}_Short"],
-                row[f"G{i}_Long1"],
-                row[f"G{i}_Long2"]
-            ]
-            for trace in range(3):
-                data[i][trace].append(group_values[trace])
+        data.append(readings[CURRENT_INDEX])
+        times.append(time_values[CURRENT_INDEX])
         CURRENT_INDEX += 1
 
         # Update each subplot.
+        positions, traces = decimator.decimate()
+        x = times.trace(0, 0)[positions]
         for i in range(8):
             for trace in range(3):
-                x = list(df["Time (s)"].iloc[:len(data[i][trace])])
-                curves[i][trace].setData(x, list(data[i][trace]))
+                curves[i][trace].setData(x, traces[i, trace])
     else:
         # Once all rows are rendered, stop the timer and quit.
         timer.stop()
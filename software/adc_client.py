@@ -9,10 +9,14 @@ updates of the plots.
 
 import sys
 import signal
-import collections
+import threading
+import numpy as np
 import socketio
 from PyQt5 import QtWidgets, QtCore
 import pyqtgraph as pg
+from trace_buffer import TraceBuffer
+from redraw_scheduler import RedrawScheduler
+from decimation import MinMaxDecimator
 
 # Signal handler to exit gracefully.
 def signal_handler():
@@ -33,20 +37,28 @@ pg.setConfigOption('background', 'w')
 pg.setConfigOption('foreground', 'k')
 
 # Data storage: For 8 groups and 3 traces per group, storing the last 5000 data points.
-data = [[collections.deque(maxlen=5000) for _ in range(3)] for _ in range(8)]
+MAX_POINTS = 5000
+data = TraceBuffer(8, 3, MAX_POINTS)
+x_values = np.arange(MAX_POINTS)
+decimator = MinMaxDecimator(data)
+
+# Interval (seconds) over which received messages are batched into one signal.
+BATCH_INTERVAL = 0.02
 
 # Define a QThread to run the SocketIO client.
 class SocketClientThread(QtCore.QThread):
     """
     SocketClientThread is a QThread that connects to a SocketIO server
-    and listens for incoming data. It emits a signal with the received
-    sensor array when new data is available.
+    and listens for incoming data. Sensor arrays received within
+    BATCH_INTERVAL are gathered and emitted as a single (N, 24) block.
     """
-    newData = QtCore.pyqtSignal(list)  # will emit the sensor array
+    newData = QtCore.pyqtSignal(np.ndarray)  # will emit the (N, 24) sensor block
 
     def __init__(self, parent=None):
         super().__init__(parent)
         self.sio = socketio.Client()
+        self.pending = []
+        self.pending_lock = threading.Lock()
 
         @self.sio.event
         def connect():
@@ -60,28 +72,46 @@ class SocketClientThread(QtCore.QThread):
         def on_processed_data(message):
             sensor_array = message.get('sensor_array', [])
             if len(sensor_array) == 24:
-                self.newData.emit(sensor_array)
+                with self.pending_lock:
+                    self.pending.append(sensor_array)
             else:
                 print("Received data does not contain 24 elements.")
 
     def run(self):
         """
         Run the SocketIO client loop.
-        This method connects to the SocketIO server and starts listening
-        for incoming data.
+        This method connects to the SocketIO server and flushes the
+        received data every BATCH_INTERVAL until the thread is interrupted.
+        The client reconnects by itself after a transient disconnect, so
+        the loop keeps running while it is disconnected.
         """
         try:
             self.sio.connect('http://localhost:5000')
-            # Run the SocketIO client loop until the thread is interrupted.
-            self.sio.wait()
         except Exception as e:
             print("SocketIO connection error:", e)
+            return
+        try:
+            while not self.isInterruptionRequested():
+                self.sio.sleep(BATCH_INTERVAL)
+                self.flush()
+        finally:
+            self.sio.disconnect()
+
+    def flush(self):
+        """
+        Emit all sensor arrays received since the last flush as one block.
+        """
+        with self.pending_lock:
+            pending, self.pending = self.pending, []
+        if pending:
+            self.newData.emit(np.array(pending, dtype=float))
 
     def stop(self):
         """
         Stop the SocketIO client and quit the thread.
+        The client is disconnected when the run loop exits.
         """
-        self.sio.disconnect()
+        self.requestInterruption()
         self.quit()
 
 # Create the Qt Application.
@@ -144,31 +174,28 @@ main_layout.addWidget(win)
 def update():
     """
     Update function to refresh the plots with new data.
-    This function is called periodically to redraw the curves
-    with the latest data from the deque.
+    This function is called by the redraw scheduler whenever the
+    trace buffer has changed.
     """
+    positions, traces = decimator.decimate()
+    x = x_values[positions]
     for group in range(8):
         for trace in range(3):
-            d = list(data[group][trace])
-            x = list(range(len(d)))
-            curves[group][trace].setData(x, d)
+            curves[group][trace].setData(x, traces[group, trace])
 
-# Timer to update the plots.
-timer = QtCore.QTimer()
-timer.timeout.connect(update)
-timer.start(1)  # Adjust refresh rate as needed.
+# Redraw only when new data arrived, capped at the display refresh rate.
+scheduler = RedrawScheduler()
+scheduler.watch(data, update)
+scheduler.start()
 
 # Slot to handle new sensor data from the SocketIO thread.
-def handle_new_data(sensor_array):
+def handle_new_data(sensor_block):
     """
     Handle new data received from the SocketIO server.
-    This function processes the incoming sensor array and updates the
+    This function takes an (N, 24) block of sensor arrays and updates the
     data storage for each group and trace.
     """
-    for group in range(8):
-        group_values = sensor_array[group * 3: group * 3 + 3]
-        for trace in range(3):
-            data[group][trace].append(group_values[trace])
+    data.extend(sensor_block.reshape(-1, 8, 3))
 
 # Start the SocketIO client thread.
 sio_thread = SocketClientThread()
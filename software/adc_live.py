@@ -6,14 +6,16 @@ It is designed to visualize ADC readings from a device connected via USB.
 """
 
 import sys
-import struct
+import logging
 import numpy as np
 import serial
 from PyQt5 import QtWidgets, QtCore
 import pyqtgraph as pg
 from config import SERIAL_PORT, BAUD_RATE, TIMEOUT
-
-PACKET_SIZE = 64
+from packet_decoder import FrameSynchronizer, decode_blocks
+from trace_buffer import TraceBuffer
+from redraw_scheduler import RedrawScheduler
+from decimation import MinMaxDecimator
 
 ser = serial.Serial(SERIAL_PORT, baudrate=BAUD_RATE, timeout=TIMEOUT)
 
@@ -21,60 +23,43 @@ ser = serial.Serial(SERIAL_PORT, baudrate=BAUD_RATE, timeout=TIMEOUT)
 trace_colors = ["red", "green", "blue"]
 trace_labels = ["Channel 1", "Channel 2", "Channel 3"]
 
-# Parse the incoming data packet.
-def parse_packet(data):
-    """
-    Parse the incoming data packet into a structured format.
-    Each packet contains 8 groups of data, each with 5 fields:
-    - Group ID
-    - Short value
-    - Long value 1
-    - Long value 2
-    - Emitter value
-    The function returns a 2D numpy array with shape (8, 5).
-    Each row corresponds to a group, and each column corresponds to a field.
-    """
-    parsed_data = np.zeros((8, 5), dtype=int)
-    for i in range(8):
-        offset = i * 8
-        group_id = data[offset]
-        raw_short = struct.unpack('>H', data[offset+1:offset+3])[0]
-        raw_long1 = struct.unpack('>H', data[offset+3:offset+5])[0]
-        raw_long2 = struct.unpack('>H', data[offset+5:offset+7])[0]
-        emitter   = data[offset+7]
-        parsed_data[i] = [group_id, raw_short, raw_long1, raw_long2, emitter]
-    return parsed_data
-
 class SerialReaderThread(QtCore.QThread):
     """
     SerialReaderThread is a QThread that reads data from a serial port.
-    It emits a signal with the parsed data when a complete packet is received.
+    It emits a signal with an (N, 8, 5) block of all packets parsed in one
+    read cycle.
     """
     newData = QtCore.pyqtSignal(np.ndarray)
     def __init__(self, parent=None):
         super().__init__(parent)
         self.running = True
+        self.synchronizer = FrameSynchronizer()
     def run(self):
         """
         Continuously read data from the serial port and parse it into packets.
-        Emit the parsed data when a complete packet is received.
+        Emit the parsed packets of each read cycle as a single block.
         """
-        read_buffer = b""
         while self.running:
-            chunk = ser.read(256)
+            # Drain the whole serial backlog instead of a fixed-size chunk.
+            chunk = ser.read(ser.in_waiting or 256)
             if chunk:
-                read_buffer += chunk
-                while len(read_buffer) >= PACKET_SIZE:
-                    packet = read_buffer[:PACKET_SIZE]
-                    read_buffer = read_buffer[PACKET_SIZE:]
-                    arr_8x5 = parse_packet(packet)
-                    self.newData.emit(arr_8x5)
+                # Only frames aligned on the F0..F7 identifiers are returned,
+                # as views into the synchronizer's ring buffer.
+                blocks = self.synchronizer.feed(chunk)
+                if blocks:
+                    # Emit every packet of this read cycle as one (N, 8, 5) block.
+                    self.newData.emit(decode_blocks(blocks))
             QtCore.QThread.msleep(1)  # avoid busy waiting
     def stop(self):
         """
         Stop the thread and close the serial port.
         """
         self.running = False
+        stats = self.synchronizer.stats()
+        # Overflowed bytes and resyncs mean the GUI thread fell behind the port.
+        fell_behind = stats['buffer_bytes_overflowed'] or stats['resync_count']
+        logging.log(logging.WARNING if fell_behind else logging.INFO,
+                    "Frame synchronization: %s", stats)
 
 
 class MainWindow(QtWidgets.QWidget):
@@ -120,7 +105,9 @@ class MainWindow(QtWidgets.QWidget):
 
         # Data storage: for 8 groups and 3 channels
         self.max_points = 3000
-        self.data = [[[ ] for _ in range(3)] for _ in range(8)]
+        self.data = TraceBuffer(8, 3, self.max_points)
+        self.x_values = np.arange(self.max_points)
+        self.decimator = MinMaxDecimator(self.data)
 
         # Create the plot widget.
         self.plot_widget = pg.GraphicsLayoutWidget(title="Live ADC Readings")
@@ -150,43 +137,42 @@ class MainWindow(QtWidgets.QWidget):
             if g % 2 == 1:
                 self.plot_widget.nextRow()
 
-        # Timer to update plots.
-        self.timer = QtCore.QTimer()
-        self.timer.timeout.connect(self.update_plots)
-        self.timer.start(50)
+        # Redraw only when new data arrived, at most once per display frame.
+        self.scheduler = RedrawScheduler(parent=self)
+        self.scheduler.watch(self.data, self.update_plots)
+        self.scheduler.start()
 
     @QtCore.pyqtSlot(np.ndarray)
-    def on_new_data(self, arr_8x5):
+    def on_new_data(self, frames):
         """
-        Slot to handle new data received from the serial port.
+        Slot to handle a (N, 8, 5) block of packets received from the serial port.
         """
-        for g in range(8):
-            self.data[g][0].append(arr_8x5[g][1])
-            self.data[g][1].append(arr_8x5[g][2])
-            self.data[g][2].append(arr_8x5[g][3])
-            for ch_idx in range(3):
-                if len(self.data[g][ch_idx]) > self.max_points:
-                    self.data[g][ch_idx].pop(0)
+        # Short, Long1 and Long2 columns of every group in one slice assignment.
+        self.data.extend(frames[:, :, 1:4])
 
     def update_plots(self):
         """
         Update the plots with the latest data.
         """
+        num_points = len(self.data)
+        if not num_points:
+            return
+        # Min/max per bucket keeps peaks visible with ~1 vertex pair per pixel.
+        positions, traces = self.decimator.decimate()
+        x = self.x_values[positions]
         for g in range(8):
             for ch_idx in range(3):
-                d = self.data[g][ch_idx]
-                if d:
-                    self.curves[g][ch_idx].setData(range(len(d)), d)
-            self.plots[g].setYRange(0, 4095, padding=0)
+                self.curves[g][ch_idx].setData(x, traces[g, ch_idx])
 
     def reset_plots(self):
         """
         Reset all plots and data storage.
         """
-        self.data = [[[ ] for _ in range(3)] for _ in range(8)]
+        self.data.clear()
         for g in range(8):
             for ch_idx in range(3):
                 self.curves[g][ch_idx].setData([])
+            self.plots[g].setYRange(0, 4095, padding=0)
 
 def main():
     """
@@ -194,6 +180,8 @@ def main():
     It creates a SerialReaderThread to read data from the serial port
     and connects it to the GUI.
     """
+    # Show the frame synchronization report logged when the reader stops.
+    logging.basicConfig(level=logging.INFO)
     # Clear any previous data from the serial port.
     ser.reset_input_buffer()
     app = QtWidgets.QApplication(sys.argv)
@@ -0,0 +1,252 @@
+"""
+batch_processing.py
+==================
+This script reprocesses many recorded sessions at once. Each session
+(an `all_groups.bin` recording or an `all_groups.csv` export) is run
+through the offline chain of fNIRS_processing.py in a separate worker
+process, and its outputs are written to a per-session directory.
+
+A session is skipped when its input file (path, size, modification time)
+and the processing parameters are unchanged since its last run, as
+recorded in the `batch_manifest.json` of its output directory. The time
+spent on every session is written to `batch_summary.csv`.
+
+Usage:
+  python batch_processing.py recordings/ "archive/**/all_groups.csv" \\
+      --output-dir processed --workers 4 --bp-low 0.02 --age 30
+"""
+
+import argparse
+import contextlib
+import csv
+import glob
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from tabulate import tabulate
+from session_recorder import SessionReader
+
+SESSION_FILES = ("all_groups.bin", "all_groups.csv")   # In order of preference
+MANIFEST_FILE = "batch_manifest.json"
+SUMMARY_FILE = "batch_summary.csv"
+OUTPUT_FILE = "processed_output.csv"
+PIPELINE_VERSION = 1   # Bump to reprocess every session after a pipeline change
+PATH_HASH_LENGTH = 8   # Hex digits of the session path hash in output directory names
+
+DEFAULT_PARAMS = {
+    'age': 22,
+    'sd_short': 0.6,
+    'sd_long': 3.5,
+    'molar_ext_coeff_table': 'wray',
+    'bp_low': 0.05,
+    'bp_high': 0.1,
+    'bp_order': 4,
+}
+
+
+def find_sessions(patterns):
+    """
+    Return the session files found in `patterns` (directories, searched
+    recursively, or glob patterns). When a directory holds both a
+    recording and its CSV export, only the recording is used.
+    """
+    sessions = set()
+    for pattern in patterns:
+        for match in (glob.glob(pattern, recursive=True) or [pattern]):
+            if os.path.isdir(match):
+                for root, _, files in os.walk(match):
+                    for name in SESSION_FILES:
+                        if name in files:
+                            sessions.add(os.path.join(root, name))
+                            break
+            elif os.path.isfile(match):
+                sessions.add(match)
+    # Drop CSV exports whose recording is also selected.
+    recordings = {os.path.dirname(s) for s in sessions if s.endswith(".bin")}
+    return sorted(s for s in sessions
+                  if s.endswith(".bin") or os.path.dirname(s) not in recordings)
+
+
+def session_output_dir(session, output_root=None):
+    """
+    Return the output directory of `session`: `<session dir>/processed`, or
+    a directory under `output_root` named after the session's path. The
+    name ends with a short hash of the absolute session directory, so paths
+    that flatten to the same name (e.g. `a_b/c` and `a/b_c`) stay apart.
+    """
+    session_dir = os.path.dirname(os.path.abspath(session))
+    if output_root is None:
+        return os.path.join(session_dir, "processed")
+    name = os.path.relpath(session_dir).replace(os.sep, "_").strip("._") or "session"
+    digest = hashlib.sha256(session_dir.encode()).hexdigest()[:PATH_HASH_LENGTH]
+    return os.path.join(output_root, f"{name}_{digest}")
+
+
+def input_fingerprint(session):
+    """
+    Return what identifies the input of a run: path, size and mtime.
+    """
+    st = os.stat(session)
+    return {'path': os.path.abspath(session), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def is_up_to_date(session, output_dir, params, chunked):
+    """
+    True if `output_dir` holds the result of processing the current
+    `session` file with the same parameters.
+    """
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return (manifest.get('version') == PIPELINE_VERSION
+            and manifest.get('input') == input_fingerprint(session)
+            and manifest.get('params') == params
+            and manifest.get('chunked') == chunked
+            and os.path.isfile(os.path.join(output_dir, OUTPUT_FILE)))
+
+
+def process_one(session, output_dir, params, chunked=False, cache_dir=None,
+                bandpass_workers=None):
+    """
+    Process one session into `output_dir` (worker process entry point).
+    The pipeline's console output goes to `processing.log`. Stage outputs
+    are cached in `cache_dir` if given (see stage_cache.py), and the
+    band-pass runs on `bandpass_workers` threads (see smart_bandpass).
+    Returns the processing time in seconds.
+    """
+    # Imported here so the parent process does not load the pipeline.
+    from fNIRS_processing import process_session
+    from chunked_processing import process_recording_chunked
+    from stage_cache import StageCache
+
+    os.makedirs(output_dir, exist_ok=True)
+    output_csv = os.path.join(output_dir, OUTPUT_FILE)
+    start = time.perf_counter()
+    with open(os.path.join(output_dir, "processing.log"), "w") as log, \
+            contextlib.redirect_stdout(log):
+        if session.endswith(".bin") and chunked:
+            process_recording_chunked(session, output_csv, **params)
+        else:
+            if session.endswith(".bin"):
+                df = SessionReader(session).to_dataframe()
+            else:
+                df = pd.read_csv(session)
+            cache = StageCache(cache_dir) if cache_dir else None
+            process_session(df, interleaved_csv=os.path.join(output_dir, "interleaved_output.csv"),
+                            output_csv=output_csv, cache=cache,
+                            bandpass_workers=bandpass_workers, **params)
+    elapsed = time.perf_counter() - start
+
+    manifest = {
+        'version': PIPELINE_VERSION,
+        'input': input_fingerprint(session),
+        'params': params,
+        'chunked': chunked,
+        'seconds': elapsed,
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return elapsed
+
+
+def run_batch(sessions, output_root=None, params=None, workers=None, chunked=False, force=False,
+              cache_dir=None, bandpass_workers=None):
+    """
+    Process `sessions` across a pool of `workers` processes (default: one
+    per CPU) and write the per-session timing to SUMMARY_FILE (in
+    `output_root`, or the working directory). Returns the summary rows.
+    `bandpass_workers` is passed to process_one; like `workers`, it does
+    not change the results, so it is not part of the manifest.
+    """
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    results = []
+    jobs = {}
+    batch_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for session in sessions:
+            output_dir = session_output_dir(session, output_root)
+            # Only recordings can be processed chunked.
+            session_chunked = chunked and session.endswith(".bin")
+            if not force and is_up_to_date(session, output_dir, params, session_chunked):
+                results.append([session, output_dir, "skipped", 0.0, ""])
+                continue
+            future = pool.submit(process_one, session, output_dir, params, session_chunked,
+                                 cache_dir, bandpass_workers)
+            jobs[future] = (session, output_dir)
+
+        for future in as_completed(jobs):
+            session, output_dir = jobs[future]
+            try:
+                results.append([session, output_dir, "done", future.result(), ""])
+            except Exception as e:
+                results.append([session, output_dir, "failed", 0.0, str(e)])
+            print(f"{results[-1][2]}: {session}")
+    wall_time = time.perf_counter() - batch_start
+
+    results.sort()
+    header = ["Session", "Output", "Status", "Seconds", "Error"]
+    summary_path = os.path.join(output_root or ".", SUMMARY_FILE)
+    os.makedirs(os.path.dirname(summary_path) or ".", exist_ok=True)
+    with open(summary_path, "w", newline="") as f_out:
+        writer = csv.writer(f_out)
+        writer.writerow(header)
+        writer.writerows(results)
+
+    print(tabulate([[r[0], r[2], f"{r[3]:.1f}", r[4]] for r in results],
+                   headers=["Session", "Status", "Seconds", "Error"]))
+    processed = sum(r[2] == "done" for r in results)
+    print(f"\n{processed} processed, {len(results) - processed} skipped or failed "
+          f"in {wall_time:.1f} s. Summary saved to '{summary_path}'.")
+    return results
+
+
+def main():
+    """
+    Parse the command line, find the sessions and process them with run_batch.
+    """
+    parser = argparse.ArgumentParser(description="Reprocess recorded fNIRS sessions in parallel.")
+    parser.add_argument("sessions", nargs="+",
+                        help="Session directories (searched recursively) or glob patterns")
+    parser.add_argument("--output-dir", help="Root of the per-session output directories "
+                                             "(default: 'processed' next to each session)")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: CPU count)")
+    parser.add_argument("--chunked", action="store_true",
+                        help="Process recordings in bounded memory (see chunked_processing.py)")
+    parser.add_argument("--force", action="store_true", help="Reprocess unchanged sessions")
+    parser.add_argument("--cache-dir", help="Cache stage outputs here, so e.g. a band-pass change "
+                                            "only re-runs the tail (see stage_cache.py)")
+    parser.add_argument("--bandpass-workers", type=int,
+                        help="Band-pass threads per session (default: one; see smart_bandpass)")
+    parser.add_argument("--age", type=float, default=DEFAULT_PARAMS['age'])
+    parser.add_argument("--sd-short", type=float, default=DEFAULT_PARAMS['sd_short'])
+    parser.add_argument("--sd-long", type=float, default=DEFAULT_PARAMS['sd_long'])
+    parser.add_argument("--table", default=DEFAULT_PARAMS['molar_ext_coeff_table'])
+    parser.add_argument("--bp-low", type=float, default=DEFAULT_PARAMS['bp_low'])
+    parser.add_argument("--bp-high", type=float, default=DEFAULT_PARAMS['bp_high'])
+    parser.add_argument("--bp-order", type=int, default=DEFAULT_PARAMS['bp_order'])
+    args = parser.parse_args()
+
+    sessions = find_sessions(args.sessions)
+    if not sessions:
+        print("No sessions found.")
+        return
+    params = {
+        'age': args.age,
+        'sd_short': args.sd_short,
+        'sd_long': args.sd_long,
+        'molar_ext_coeff_table': args.table,
+        'bp_low': args.bp_low,
+        'bp_high': args.bp_high,
+        'bp_order': args.bp_order,
+    }
+    run_batch(sessions, args.output_dir, params, args.workers, args.chunked, args.force,
+              args.cache_dir, args.bandpass_workers)
+
+
+if __name__ == '__main__':
+    main()
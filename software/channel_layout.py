@@ -0,0 +1,72 @@
+"""
+channel_layout.py
+==================
+This module describes the optode channel layout shared by the offline
+(fNIRS_processing.py) and streaming (streaming_pipeline.py) pipelines:
+channel names, wavelengths, DPFs, source-detector distances, and how the
+raw Short/Long1/Long2 readings map onto the 48 measurement channels.
+"""
+
+import numpy as np
+import nirsimple.preprocessing as nsp
+
+
+def build_channel_info(age, sd_short, sd_long):
+    """
+    Builds channel names, wavelengths, DPFs, and source-detector distances.
+    There are 24 physical channels (8 sensor groups × 3 detectors), and each is
+    measured at two wavelengths (660 nm and 940 nm), yielding 48 channels.
+    """
+    physical_channels = [f"S{s}_D{d}"
+                         for s in range(1, 9)      # sets 1–8
+                         for d in (1, 2, 3)]       # detectors 1-3
+    # The DPF only depends on wavelength and age: compute it once per wavelength.
+    dpf_660 = nsp.get_dpf(660.0, age)
+    dpf_940 = nsp.get_dpf(940.0, age)
+    channel_names, ch_wls, ch_dpfs, ch_distances = [], [], [], []
+    for name in physical_channels:
+        det_num = int(name.split("_D")[1])
+        dist    = sd_short if det_num == 1 else sd_long
+        # 660nm
+        channel_names.append(name)
+        ch_wls.append(660.0)
+        ch_dpfs.append(dpf_660)
+        ch_distances.append(dist)
+        # 940nm
+        channel_names.append(name)
+        ch_wls.append(940.0)
+        ch_dpfs.append(dpf_940)
+        ch_distances.append(dist)
+    return channel_names, ch_wls, ch_dpfs, ch_distances
+
+def build_pair_indices(channel_names, ch_wls, mode_wavelengths=(660.0, 940.0)):
+    """
+    Builds the gather indices that turn a pair of rows (mode 1 row, mode 2 row)
+    from the CSV into a 48-element sample ordered like build_channel_info.
+
+    Each row is assumed to have the following structure:
+      [Time, G0_Short, G0_Long1, G0_Long2, G0_Emitter,
+             G1_Short, G1_Long1, G1_Long2, G1_Emitter, ...,
+             G7_Short, G7_Long1, G7_Long2, G7_Emitter]
+
+    Channel "S{s}_D{d}" maps to column 1 + 4*(s-1) + (d-1); its wavelength
+    selects the mode 1 row (660 nm) or the mode 2 row (940 nm). Returns
+    (row_indices, column_indices), each of length 48.
+    """
+    row_indices, column_indices = [], []
+    for name, wl in zip(channel_names, ch_wls):
+        source, detector = name[1:].split("_D")
+        column_indices.append(1 + 4 * (int(source) - 1) + (int(detector) - 1))
+        row_indices.append(mode_wavelengths.index(wl))
+    return np.array(row_indices), np.array(column_indices)
+
+def pair_reading_indices(channel_names, ch_wls):
+    """
+    Like build_pair_indices, but the column index selects from the 24
+    readings of a frame ordered [G0_Short, G0_Long1, G0_Long2, G1_Short, ...]
+    instead of from a CSV row. Indexing a (2, 24) array of
+    [660 nm readings, 940 nm readings] with the result gives a 48-element
+    sample ordered like build_channel_info.
+    """
+    row_indices, column_indices = build_pair_indices(channel_names, ch_wls)
+    return row_indices, (column_indices - 1) // 4 * 3 + (column_indices - 1) % 4
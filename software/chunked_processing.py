@@ -0,0 +1,346 @@
+"""
+chunked_processing.py
+==================
+This module runs the offline chain of fNIRS_processing.py (threshold →
+low-pass → RMS → interleave → OD → band-pass → MBLL → CBSI) on a binary
+recording in bounded memory, so overnight sessions can be processed on
+the acquisition laptops.
+
+  - The recording is read through its memory map CHUNK_RECORDS frames at a
+    time. The zero-phase low-pass runs on each chunk plus an overlap as
+    long as the filter's settling time (overlap-save), and only the middle
+    of every chunk is kept.
+  - Emitter segments that cross a chunk edge are carried over as running
+    sums of squares, so each segment reduces to its RMS and length. The
+    interleaved rows are never materialized: every segment pair is written
+    to a temporary memory-mapped file as one 48-channel intensity sample
+    and its repeat count.
+  - The band-pass of smart_bandpass (down-sample, sosfiltfilt, up-sample)
+    runs chunk by chunk through temporary memory-mapped files, with the
+    overlaps given by resample_margin() and settling_samples().
+  - CBSI needs the standard deviation of the whole session, so the
+    concentrations are computed twice: once for the statistics, once to
+    write the output.
+
+The output matches process_csv_dataset run on the in-memory pipeline up to
+floating-point rounding (and the settling tolerance of the filters).
+"""
+
+import csv
+import os
+import tempfile
+import numpy as np
+from scipy.signal import resample_poly, sosfiltfilt
+from channel_layout import build_channel_info, pair_reading_indices
+from filter_design import butter_sos, resample_kernel, resample_margin, settling_samples
+from mbll_operator import apply_mbll, hemoglobin_channels, mbll_matrices
+from packet_decoder import NUM_GROUPS, ZERO_LEVEL
+from session_recorder import SessionReader, records_to_rows
+
+NUM_READINGS = NUM_GROUPS * 3   # Short, Long1 and Long2 of every group
+CHUNK_RECORDS = 1 << 18         # Frames read from the recording per chunk
+CHUNK_SAMPLES = 1 << 14         # Down-sampled samples per band-pass chunk
+SETTLE_TOL = 1e-12              # Relative impulse-response level used for overlaps
+PAIR_BUFFER = 1 << 12           # Segment pairs buffered before writing to disk
+
+
+def recording_sampling_rate(records):
+    """
+    Return the frame rate of a recording, estimated like the `__main__`
+    pipeline does from the rounded timestamps.
+    """
+    first, last = np.round(records['timestamp'][[0, -1]], 3)
+    return 1.0 / ((last - first) / (len(records) - 1))
+
+
+def emitter_segments(records, fs, lowpass_hz=1.0, lowpass_order=4, lower_threshold=200,
+                     upper_threshold=4000, zero_level=ZERO_LEVEL,
+                     chunk_records=CHUNK_RECORDS, settle_tol=SETTLE_TOL):
+    """
+    Threshold and low-pass the readings of `records` (RECORD_DTYPE) chunk by
+    chunk and yield (rms, count) for every G0 emitter segment, in order,
+    like sliding_window_rms. `rms` has shape (24,) and `count` is the
+    segment length in frames.
+    """
+    sos = butter_sos(lowpass_order, lowpass_hz, fs, btype='low')
+    overlap = settling_samples(sos, settle_tol)
+    num_records = len(records)
+
+    mode, sum_sq, count = None, np.zeros(NUM_READINGS), 0
+    for start in range(0, num_records, chunk_records):
+        stop = min(start + chunk_records, num_records)
+        lo, hi = max(start - overlap, 0), min(stop + overlap, num_records)
+        rows = records_to_rows(records[lo:hi], invert=True, zero_level=zero_level)
+        groups = rows[:, 1:].reshape(hi - lo, NUM_GROUPS, 4)
+        readings = groups[:, :, :3].reshape(hi - lo, NUM_READINGS)
+        readings = np.where((readings < lower_threshold) | (readings > upper_threshold),
+                            zero_level, readings)
+        squares = np.square(sosfiltfilt(sos, readings, axis=0)[start - lo:stop - lo])
+        emitter = groups[start - lo:stop - lo, 0, 3]
+
+        # Runs of constant emitter status within the chunk.
+        boundaries = np.flatnonzero(emitter[1:] != emitter[:-1]) + 1
+        if mode is not None and emitter[0] != mode:
+            boundaries = np.concatenate(([0], boundaries))
+        bounds = np.concatenate(([0], boundaries, [len(emitter)]))
+        sums = np.add.reduceat(squares, bounds[:-1], axis=0)
+        for run_start, run_stop, run_sum in zip(bounds[:-1], bounds[1:], sums):
+            if run_stop == run_start:
+                continue
+            if run_start in boundaries and count:
+                yield np.sqrt(sum_sq / count), count
+                sum_sq, count = np.zeros(NUM_READINGS), 0
+            mode = emitter[run_start]
+            sum_sq += run_sum
+            count += run_stop - run_start
+    if count:
+        yield np.sqrt(sum_sq / count), count
+
+
+def _open_memmap(path, dtype, shape, mode='r'):
+    """
+    Return a memory map of `path` with the given shape, or an empty array if
+    the shape has no rows (zero-size files cannot be mapped).
+    """
+    if not shape[0]:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode, shape=shape)
+
+
+def _write_pairs(f_intensity, f_repeat, intensities, repeats):
+    """
+    Append buffered segment pairs to the files of pair_segments.
+    """
+    f_intensity.write(np.array(intensities, dtype=float).tobytes())
+    f_repeat.write(np.array(repeats, dtype=np.int64).tobytes())
+
+
+def pair_segments(segments, pair_index, tmp_dir, buffer_pairs=PAIR_BUFFER):
+    """
+    Pair consecutive segments like interleave_mode_blocks (a leftover
+    segment is dropped). Returns (intensities, repeats): one 48-channel
+    sample per pair, gathered with `pair_index` (see pair_reading_indices),
+    and the number of interleaved row pairs it spans. Both are written to
+    memory-mapped files in `tmp_dir` as they are produced, so at most
+    `buffer_pairs` pairs are held in memory.
+    """
+    intensity_path = os.path.join(tmp_dir, "pair_intensities.dat")
+    repeat_path = os.path.join(tmp_dir, "pair_repeats.dat")
+    num_pairs = 0
+    intensities, repeats = [], []
+    pending = None
+    with open(intensity_path, 'wb') as f_intensity, open(repeat_path, 'wb') as f_repeat:
+        for rms, count in segments:
+            if pending is None:
+                pending = (rms, count)
+                continue
+            intensities.append(np.stack((pending[0], rms))[pair_index])
+            repeats.append(max(pending[1], count))
+            num_pairs += 1
+            pending = None
+            if len(intensities) == buffer_pairs:
+                _write_pairs(f_intensity, f_repeat, intensities, repeats)
+                intensities, repeats = [], []
+        if intensities:
+            _write_pairs(f_intensity, f_repeat, intensities, repeats)
+
+    return (_open_memmap(intensity_path, float, (num_pairs, len(pair_index[0]))),
+            _open_memmap(repeat_path, np.int64, (num_pairs,)))
+
+
+def _expand(values, offsets, start, stop):
+    """
+    Return rows [start, stop) of np.repeat(values, np.diff(offsets), axis=0).
+    """
+    first = np.searchsorted(offsets, start, 'right') - 1
+    last = np.searchsorted(offsets, stop, 'left')
+    counts = np.minimum(offsets[first + 1:last + 1], stop) - np.maximum(offsets[first:last], start)
+    return np.repeat(values[first:last], counts, axis=0)
+
+
+def _od_to_memmap(intensities, repeats, chunk_samples, tmp_dir):
+    """
+    Convert the paired intensities to OD changes relative to the session
+    mean (weighted by the repeat counts), chunk by chunk, into a
+    memory-mapped file. Returns (delta_od, offsets): offsets[k] is the
+    first interleaved row pair of segment pair k, offsets[-1] their total.
+    """
+    num_pairs, num_channels = intensities.shape
+    offsets = np.memmap(os.path.join(tmp_dir, "pair_offsets.dat"), dtype=np.int64, mode='w+',
+                        shape=(num_pairs + 1,))
+    offsets[0] = 0
+    sums = np.zeros(num_channels)
+    for c0 in range(0, num_pairs, chunk_samples):
+        c1 = min(c0 + chunk_samples, num_pairs)
+        offsets[c0 + 1:c1 + 1] = offsets[c0] + np.cumsum(repeats[c0:c1])
+        sums += (np.absolute(intensities[c0:c1]) * repeats[c0:c1, None]).sum(axis=0)
+    means = sums / max(int(offsets[-1]), 1)
+
+    delta_od = _open_memmap(os.path.join(tmp_dir, "pair_od.dat"), float,
+                            (num_pairs, num_channels), mode='w+')
+    for c0 in range(0, num_pairs, chunk_samples):
+        c1 = min(c0 + chunk_samples, num_pairs)
+        delta_od[c0:c1] = -np.log10(np.absolute(intensities[c0:c1]) / means)
+    return delta_od, offsets
+
+
+def _bandpass_to_memmap(delta_od, offsets, fs, lowcut, highcut, order, target_fs,
+                        chunk_samples, settle_tol, tmp_dir):
+    """
+    Band-pass the expanded OD signal like smart_bandpass, writing the result
+    at the (possibly down-sampled) filter rate to a memory-mapped file.
+    Returns (bandpassed, decim) with `bandpassed` of shape (M, 48).
+    """
+    num_samples = int(offsets[-1])
+    num_channels = delta_od.shape[1]
+    if fs > target_fs + 1:
+        decim = int(round(fs / target_fs))
+        fs_ds = fs / decim
+    else:
+        decim, fs_ds = 1, fs
+    num_ds = -(-num_samples // decim)
+
+    # 1) Down-sample (exact: each chunk is extended by the FIR margin)
+    down = np.memmap(os.path.join(tmp_dir, "od_down.dat"), dtype=float, mode='w+',
+                     shape=(num_ds, num_channels))
+    margin = resample_margin(1, decim) if decim > 1 else 0
+    for m0 in range(0, num_ds, chunk_samples):
+        m1 = min(m0 + chunk_samples, num_ds)
+        lo, hi = max(m0 - margin, 0), min(m1 + margin, num_ds)
+        x = _expand(delta_od, offsets, lo * decim, min(hi * decim, num_samples))
+        if decim > 1:
+            x = resample_poly(x, up=1, down=decim, axis=0, window=resample_kernel(1, decim))
+        down[m0:m1] = x[m0 - lo:m1 - lo]
+
+    # 2) Zero-phase band-pass (overlap-save over the filter's settling time)
+    sos = butter_sos(order, (lowcut, highcut), fs_ds, btype="band")
+    overlap = settling_samples(sos, settle_tol)
+    bandpassed = np.memmap(os.path.join(tmp_dir, "od_bandpassed.dat"), dtype=float, mode='w+',
+                           shape=(num_ds, num_channels))
+    for c0 in range(0, num_ds, chunk_samples):
+        c1 = min(c0 + chunk_samples, num_ds)
+        lo, hi = max(c0 - overlap, 0), min(c1 + overlap, num_ds)
+        filtered = sosfiltfilt(sos, down[lo:hi], axis=0, padtype="odd", padlen=3 * (order + 1))
+        bandpassed[c0:c1] = filtered[c0 - lo:c1 - lo]
+    return bandpassed, decim
+
+
+def _concentration_chunks(bandpassed, decim, matrices, chunk_samples):
+    """
+    Yield (start, delta_c) chunks of the up-sampled, MBLL-converted signal,
+    with delta_c of shape (48, n).
+    """
+    num_ds = len(bandpassed)
+    margin = resample_margin(decim, 1) if decim > 1 else 0
+    for c0 in range(0, num_ds, chunk_samples):
+        c1 = min(c0 + chunk_samples, num_ds)
+        lo, hi = max(c0 - margin, 0), min(c1 + margin, num_ds)
+        delta_od = np.asarray(bandpassed[lo:hi])
+        if decim > 1:
+            delta_od = resample_poly(delta_od, up=decim, down=1, axis=0,
+                                     window=resample_kernel(decim, 1))
+        delta_od = delta_od[(c0 - lo) * decim:(c1 - lo) * decim]
+        yield c0 * decim, apply_mbll(delta_od.T, matrices)
+
+
+def process_recording_chunked(
+    record_path,
+    output_csv,
+    age=22,
+    sd_short=0.6,
+    sd_long=3.5,
+    molar_ext_coeff_table='wray',
+    bp_low=0.05,
+    bp_high=0.1,
+    bp_order=4,
+    lowpass_hz=1.0,
+    lowpass_order=4,
+    increment=0.001,
+    target_fs=20.0,
+    chunk_records=CHUNK_RECORDS,
+    chunk_samples=CHUNK_SAMPLES,
+    settle_tol=SETTLE_TOL,
+    tmp_dir=None
+):
+    """
+    Process a binary recording (see session_recorder.py) into `output_csv`,
+    with the same result and layout as the `__main__` pipeline of
+    fNIRS_processing.py followed by process_csv_dataset, in bounded memory.
+
+    Parameters:
+      record_path (str): Binary recording.
+      output_csv (str): Processed output (Time, {channel}_{hbo|hbr} ...).
+      age ... bp_order: As in process_csv_dataset.
+      lowpass_hz, lowpass_order: As in the `__main__` pipeline.
+      increment (float): Time step of the interleaved rows.
+      target_fs (float): As in smart_bandpass.
+      chunk_records (int): Frames processed per chunk.
+      chunk_samples (int): Down-sampled samples processed per chunk.
+      settle_tol (float): Impulse-response level that sets the filter overlaps.
+      tmp_dir (str): Directory for the temporary memory-mapped files.
+    """
+    records = SessionReader(record_path).records
+    if len(records) < 2:
+        print("Insufficient data rows for processing.")
+        return
+
+    channel_names, ch_wls, _, _ = build_channel_info(age, sd_short, sd_long)
+    matrices = mbll_matrices(age, sd_short, sd_long, molar_ext_coeff_table)
+    ch_names, ch_types = hemoglobin_channels(channel_names)
+    num_pairs = len(ch_names) // 2
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        segments = emitter_segments(records, recording_sampling_rate(records),
+                                    lowpass_hz=lowpass_hz, lowpass_order=lowpass_order,
+                                    chunk_records=chunk_records, settle_tol=settle_tol)
+        intensities, repeats = pair_segments(segments, pair_reading_indices(channel_names, ch_wls),
+                                             tmp)
+
+        # OD changes relative to the session mean, computed per segment pair
+        delta_od, offsets = _od_to_memmap(intensities, repeats, chunk_samples, tmp)
+        num_samples = int(offsets[-1])
+        if num_samples < 2:
+            print("Insufficient data rows for processing.")
+            return
+
+        # Sample times of the mode 1 rows, as written to the interleaved CSV
+        last_time = round(2 * (num_samples - 1) * increment, 3)
+        fs = 1.0 / (last_time / (num_samples - 1))
+
+        bandpassed, decim = _bandpass_to_memmap(delta_od, offsets, fs, bp_low, bp_high, bp_order,
+                                                target_fs, chunk_samples, settle_tol, tmp)
+
+        # Pass 1: session-wide HbO/HbR standard deviations for CBSI
+        count, mean, m2 = 0, np.zeros((num_pairs, 2)), np.zeros((num_pairs, 2))
+        for _, delta_c in _concentration_chunks(bandpassed, decim, matrices, chunk_samples):
+            block = delta_c.reshape(num_pairs, 2, -1)
+            block_count = block.shape[2]
+            block_mean = block.mean(axis=2)
+            delta = block_mean - mean
+            total = count + block_count
+            mean += delta * block_count / total
+            m2 += ((block - block_mean[..., None]) ** 2).sum(axis=2)
+            m2 += delta ** 2 * count * block_count / total
+            count = total
+        std = np.sqrt(m2 / count)
+        alpha = (std[:, 0] / std[:, 1])[:, None]
+
+        # Pass 2: apply CBSI and write one row per interleaved row pair
+        with open(output_csv, "w", newline="") as f_out:
+            writer = csv.writer(f_out)
+            headers = [f"{name}_{ctype}" for name, ctype in zip(ch_names, ch_types)]
+            writer.writerow(["Time"] + headers)
+            for start, delta_c in _concentration_chunks(bandpassed, decim, matrices, chunk_samples):
+                stop = min(start + delta_c.shape[1], num_samples)
+                if stop <= start:
+                    break
+                block = delta_c[:, :stop - start].reshape(num_pairs, 2, -1)
+                corrected = np.empty_like(block)
+                corrected[:, 0] = (block[:, 0] - alpha * block[:, 1]) / 2
+                corrected[:, 1] = -corrected[:, 0] / alpha
+                times = np.round(2 * np.arange(start, stop) * increment, 3)
+                rows = np.column_stack((times, corrected.reshape(len(ch_names), -1).T))
+                writer.writerows(rows.tolist())
+        del intensities, repeats, delta_od, offsets, bandpassed
+
+    print(f"Post-processing complete. Output saved to '{output_csv}'.")
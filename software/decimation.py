@@ -0,0 +1,92 @@
+"""
+decimation.py
+==================
+This module reduces long live traces to roughly one vertex pair per screen
+pixel before they are handed to PlotDataItem.setData. Each bucket of
+consecutive samples is replaced by its minimum and maximum, so peaks stay
+visible, and all groups and channels of a TraceBuffer are reduced at once.
+"""
+
+import numpy as np
+
+DEFAULT_MAX_POINTS = 1000  # Vertices per curve after decimation
+
+
+def minmax_buckets(samples, bucket_size):
+    """
+    Reduce the last axis of `samples` (a multiple of `bucket_size` long)
+    to per-bucket minima and maxima, each of shape (..., num_buckets).
+    """
+    shaped = samples.reshape(samples.shape[:-1] + (-1, bucket_size))
+    return shaped.min(axis=-1), shaped.max(axis=-1)
+
+
+class MinMaxDecimator:
+    """
+    MinMaxDecimator reduces every trace of a TraceBuffer with min/max per
+    bucket. Buckets are aligned to the absolute sample count, so a bucket
+    that is complete never changes while it is inside the window; its
+    result is cached and each call only reduces the buckets completed since
+    the previous call plus the partial buckets at both window edges.
+    """
+    def __init__(self, buffer, max_points=DEFAULT_MAX_POINTS):
+        self.buffer = buffer
+        self.bucket_size = max(1, -(-2 * buffer.capacity // max_points))
+        num_slots = buffer.capacity // self.bucket_size + 2
+        shape = (buffer.num_groups, buffer.num_channels, num_slots)
+        self._min = np.empty(shape, dtype=buffer.dtype)
+        self._max = np.empty(shape, dtype=buffer.dtype)
+        self._cached_upto = 0  # Absolute index of the first uncached bucket
+
+    def decimate(self):
+        """
+        Return (positions, values) for the current buffer window:
+          positions: (M,) sample indices into the window, to index the x values.
+          values: (num_groups, num_channels, M) decimated traces.
+        Short windows are returned undecimated. `values` never aliases the
+        buffer, so later appends cannot change data a plot item still holds.
+        """
+        view = self.buffer.view()
+        num_samples = view.shape[-1]
+        size = self.bucket_size
+        if size == 1 or num_samples <= 2 * (self.buffer.capacity // size):
+            return np.arange(num_samples), view.copy()
+
+        total = self.buffer.total_samples
+        window_start = total - num_samples
+        first_full = -(-window_start // size)
+        last_full = total // size
+        num_slots = self._min.shape[-1]
+
+        # Reduce only the complete buckets that are not cached yet.
+        new_start = max(first_full, self._cached_upto)
+        if last_full > new_start:
+            offset = new_start * size - window_start
+            mins, maxs = minmax_buckets(view[..., offset:last_full * size - window_start], size)
+            slots = np.arange(new_start, last_full) % num_slots
+            self._min[..., slots] = mins
+            self._max[..., slots] = maxs
+            self._cached_upto = last_full
+
+        slots = np.arange(first_full, last_full) % num_slots
+        starts = [np.arange(first_full, last_full) * size - window_start]
+        mins = [self._min[..., slots]]
+        maxs = [self._max[..., slots]]
+
+        # Partial buckets at the head and tail of the window.
+        head = first_full * size - window_start
+        if head > 0:
+            starts.insert(0, np.array([0]))
+            mins.insert(0, view[..., :head].min(axis=-1, keepdims=True))
+            maxs.insert(0, view[..., :head].max(axis=-1, keepdims=True))
+        tail = last_full * size - window_start
+        if tail < num_samples:
+            starts.append(np.array([tail]))
+            mins.append(view[..., tail:].min(axis=-1, keepdims=True))
+            maxs.append(view[..., tail:].max(axis=-1, keepdims=True))
+
+        starts = np.concatenate(starts)
+        values = np.empty(view.shape[:-1] + (2 * len(starts),), dtype=view.dtype)
+        values[..., 0::2] = np.concatenate(mins, axis=-1)
+        values[..., 1::2] = np.concatenate(maxs, axis=-1)
+        return np.repeat(starts, 2), values
@@ -8,21 +8,40 @@ Beer-Lambert Law on the dataset to compute hemoglobin concentration changes.
 """
 
 import csv
-import time
+import queue
+import sys
 import signal
-import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from tabulate import tabulate
 import nirsimple.preprocessing as nsp
 import nirsimple.processing as nproc
-import pandas as pd
 import serial
+import socketio
 from config import SERIAL_PORT, BAUD_RATE, TIMEOUT
-from scipy.signal import butter, sosfiltfilt, resample_poly, filtfilt
-
-ser = serial.Serial(SERIAL_PORT, baudrate=BAUD_RATE, timeout=TIMEOUT)
+from packet_decoder import PACKET_SIZE, ZERO_LEVEL, FrameSynchronizer, decode_blocks, decode_frames
+from session_recorder import SessionReader, SessionRecorder, export_csv
+from filter_design import butter_sos, quantize, resample_kernel
+from channel_layout import build_channel_info, build_pair_indices
+from streaming_pipeline import StreamingProcessor
+from mbll_operator import apply_mbll, hemoglobin_channels, mbll_matrices
+from chunked_processing import process_recording_chunked
+from stage_cache import chain_keys, frame_key, run_stages
+from scipy.signal import sosfiltfilt, resample_poly
+
+# Opened in __main__, so the processing functions can be imported without
+# claiming the serial port (e.g. by batch_processing.py).
+ser = None
 
 STOP_FLAG = False  # Global flag for stopping the capture loop
+# Process the recording in bounded memory (see chunked_processing.py)
+CHUNKED = any(arg.lower() == 'chunked' for arg in sys.argv[1:])
+# Stream live concentrations to the visualizer while recording
+STREAM = any(arg.lower() == 'stream' for arg in sys.argv[1:])
+STREAM_URL = "http://127.0.0.1:8050"  # visualizer.py Socket.IO server
+# Default threads of smart_bandpass (None or 1: filter all channels in one call)
+BANDPASS_WORKERS = None
 
 def handle_stop_signal():
     """
@@ -48,36 +67,43 @@ def revert_inversion(df_in, zero_level=2050, out_csv="all_groups_no_inv.csv"):
     print(f"✓ Wrote non-inverted data → {out_csv}")
     return df
 
-def threshold_filter(df, lower_threshold=200, upper_threshold=4000, zero_level=2050, exclude_columns=None):
-    """Suppress outliers of a data frame."""
+def threshold_filter(df, lower_threshold=200, upper_threshold=4000, zero_level=2050,
+                     exclude_columns=None, inplace=False):
+    """
+    Suppress outliers of a data frame.
+    All non-excluded columns are thresholded as one 2-D block. If `inplace`
+    is True, `df` is modified and returned instead of a copy.
+    """
     if exclude_columns is None:
         exclude_columns = []
 
-    suppressed_df = df.copy()
-
-    for col in df.columns:
-        if col not in exclude_columns:
-            suppressed_df[col] = np.where(
-                (df[col] < lower_threshold) | (df[col] > upper_threshold),
-                zero_level,
-                df[col]
-            )
+    suppressed_df = df if inplace else df.copy()
+    cols = [col for col in df.columns if col not in exclude_columns]
+    values = df[cols].to_numpy()
+    suppressed_df[cols] = np.where(
+        (values < lower_threshold) | (values > upper_threshold),
+        zero_level,
+        values
+    )
 
     return suppressed_df
 
-def butter_lowpass_filter(df, cutoff_hz, fs, order=4, exclude_columns=None):
-    """Apply a low-pass Butterworth filter to selected columns of a data frame."""
+def butter_lowpass_filter(df, cutoff_hz, fs, order=4, exclude_columns=None, inplace=False):
+    """
+    Apply a low-pass Butterworth filter to selected columns of a data frame.
+    The filter is designed in second-order sections (SOS) for numerical
+    stability and applied zero-phase to all selected columns in one
+    sosfiltfilt call. If `inplace` is True, `df` is modified and returned
+    instead of a copy.
+    """
     if exclude_columns is None:
         exclude_columns = []
 
-    filtered_df = df.copy()
-    nyquist = 0.5 * fs
-    normal_cutoff = cutoff_hz / nyquist
-    b, a = butter(order, normal_cutoff, btype='low', analog=False)
+    filtered_df = df if inplace else df.copy()
+    sos = butter_sos(order, cutoff_hz, fs, btype='low')
 
-    for col in df.columns:
-        if col not in exclude_columns:
-            filtered_df[col] = filtfilt(b, a, df[col])
+    cols = [col for col in df.columns if col not in exclude_columns]
+    filtered_df[cols] = sosfiltfilt(sos, df[cols].to_numpy(dtype=float), axis=0)
 
     return filtered_df
 
@@ -86,151 +112,179 @@ def sliding_window_rms(df, emitter_col="G0_Emitter", group_prefix="G", num_group
     """
     Apply RMS calculation to segments defined by the 
     emitter transitions 
+
+    All Short/Long1/Long2 columns are processed at once: segment boundaries
+    are computed once and the per-segment mean-square is obtained with
+    np.add.reduceat, then broadcast back to the rows with a single gather.
     """
     df_rms = df.copy()
+    num_rows = len(df)
+    if num_rows == 0:
+        return df_rms
 
-    emitter_reference = df[emitter_col].values
-    change_points = np.where(np.diff(emitter_reference) != 0)[0] + 1
-    segments = np.split(np.arange(len(df)), change_points)
+    cols = [f"{group_prefix}{g}_{name}"
+            for g in range(num_groups)
+            for name in ("Short", "Long1", "Long2")]
+    values = df[cols].to_numpy(dtype=float)
 
+    # Segment start rows: every emitter transition (and optionally the midpoints).
+    emitter_reference = df[emitter_col].values
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(emitter_reference) != 0) + 1))
     if split_segments_in_half:
-        split_segments = []
-        for segment in segments:
-            n = len(segment)
-            if n == 0:
-                continue
-            mid = n // 2
-            split_segments.append(segment[:mid])
-            split_segments.append(segment[mid:])
-        segments = split_segments
-
-    groups = [f"{group_prefix}{i}" for i in range(num_groups)]
-
-    for g in groups:
-        short_col = f"{g}_Short"
-        long1_col = f"{g}_Long1"
-        long2_col = f"{g}_Long2"
-
-        for segment in segments:
-            if len(segment) == 0:
-                continue
-            segment_idx = segment.tolist()
-
-            for col in [short_col, long1_col, long2_col]:
-                segment_data = df.loc[segment_idx, col]
-                if remove_dc:
-                    segment_data = segment_data - segment_data.mean()
-                rms_val = np.sqrt(np.mean(np.square(segment_data)))
-                df_rms.loc[segment_idx, col] = rms_val
+        lengths = np.diff(np.append(starts, num_rows))
+        starts = np.unique(np.concatenate((starts, starts + lengths // 2)))
+    lengths = np.diff(np.append(starts, num_rows))
+    segment_ids = np.repeat(np.arange(len(starts)), lengths)
+
+    if remove_dc:
+        means = np.add.reduceat(values, starts, axis=0) / lengths[:, None]
+        values = values - means[segment_ids]
+    mean_square = np.add.reduceat(np.square(values), starts, axis=0) / lengths[:, None]
+    df_rms[cols] = np.sqrt(mean_square)[segment_ids]
 
     return df_rms
 
 
 def butter_bandpass_sos(lowcut, highcut, fs, order=4):
-    """Return an SOS band-pass filter."""
-    nyq = 0.5 * fs
-    sos = butter(order, [lowcut / nyq, highcut / nyq],
-                 btype="band", output="sos")
-    return sos
+    """Return an SOS band-pass filter (cached, see filter_design.py)."""
+    return butter_sos(order, (lowcut, highcut), fs, btype="band")
 
 def smart_bandpass(data, fs,
                    lowcut=0.05, highcut=0.1, order=4,
-                   target_fs=20.0):
+                   target_fs=20.0, workers=None):
     """
     Zero-phase band-pass along *time* axis.
     `data` shape: (n_channels, n_timepoints)
+
+    If `workers` (default: BANDPASS_WORKERS, read at call time) > 1, the
+    channels are split into that many blocks that are filtered in a thread
+    pool; resample_poly and sosfiltfilt release the GIL, so the blocks run
+    on separate cores. The result is the same.
     """
+    if workers is None:
+        workers = BANDPASS_WORKERS
+    if workers is not None and workers > 1 and len(data) > 1:
+        blocks = np.array_split(data, min(workers, len(data)), axis=0)
+        with ThreadPoolExecutor(max_workers=len(blocks)) as pool:
+            filtered = pool.map(lambda block: smart_bandpass(block, fs, lowcut, highcut, order,
+                                                             target_fs, workers=1), blocks)
+            return np.concatenate(list(filtered), axis=0)
+
     # Down-sample
     if fs > target_fs + 1: # leave a little margin
         decim = int(round(fs / target_fs))
         fs_ds = fs / decim
-        data_ds = resample_poly(data, up=1, down=decim, axis=1)
+        data_ds = resample_poly(data, up=1, down=decim, axis=1,
+                                window=resample_kernel(1, decim))
     else:
         decim, fs_ds, data_ds = 1, fs, data
-    # Design stable filter
+    # Design stable filter (reused from the cache when unchanged)
     sos = butter_bandpass_sos(lowcut, highcut, fs_ds, order)
     # Zero-phase filtering
     data_bp = sosfiltfilt(sos, data_ds, axis=1, padtype="odd",
                           padlen=3 * (order + 1))
     # Up-sample back if we had decimated
     if decim > 1:
-        data_bp = resample_poly(data_bp, up=decim, down=1, axis=1)
+        data_bp = resample_poly(data_bp, up=decim, down=1, axis=1,
+                                window=resample_kernel(decim, 1))
     return data_bp
 
 def parse_packet(data):
-    """ 
+    """
     Parses 64 raw bytes into an 8×5 array of sensor data:
        [Group ID, Short, Long1, Long2, Emitter Status].
+    The readings are inverted around ZERO_LEVEL.
+    """
+    return decode_frames(data[:PACKET_SIZE], invert=True, zero_level=ZERO_LEVEL)[0]
+
+def stream_concentrations(frame_queue, processor, client):
+    """
+    Worker loop of record_data: processes the raw frame blocks put on
+    `frame_queue` with `processor` (a StreamingProcessor) and emits the
+    latest concentrations as 'live_concentrations' through `client`.
+    Blocks that queued up while an emit was in progress are processed
+    together, so a slow server delays the updates but never the serial
+    reads. A None item ends the loop.
     """
-    ZERO_LEVEL = 2050
-    parsed_data = np.zeros((8, 5), dtype=int)
-    for i in range(8):
-        offset = i * 8
-        packet_identifier = data[offset]
-        sensor_channel_1 = struct.unpack('>H', data[offset+1:offset+3])[0]
-        sensor_channel_inv1 = 2 * ZERO_LEVEL - sensor_channel_1
-        sensor_channel_2 = struct.unpack('>H', data[offset+3:offset+5])[0]
-        sensor_channel_inv2 = 2 * ZERO_LEVEL - sensor_channel_2
-        sensor_channel_3 = struct.unpack('>H', data[offset+5:offset+7])[0]
-        sensor_channel_inv3 = 2 * ZERO_LEVEL - sensor_channel_3
-        emitter_status    = data[offset+7]
-
-        parsed_data[i] = [
-            packet_identifier,
-            sensor_channel_inv1,
-            sensor_channel_inv2,
-            sensor_channel_inv3,
-            emitter_status
-        ]
-    return parsed_data
-
-def capture_data(csv_filename, stop_on_enter=True):
+    while True:
+        blocks = frame_queue.get()
+        stop = blocks is None
+        blocks = blocks or []
+        # Catch up on everything queued since the last emit.
+        while not stop:
+            try:
+                more = frame_queue.get_nowait()
+            except queue.Empty:
+                break
+            if more is None:
+                stop = True
+            else:
+                blocks += more
+        if blocks:
+            frames = decode_blocks(blocks, invert=True, zero_level=ZERO_LEVEL)
+            _, concentrations = processor.process(frames)
+            if concentrations.shape[1] and client.connected:
+                try:
+                    client.emit('live_concentrations',
+                                {'concentrations': concentrations[:, -1].tolist()})
+                except Exception as e:
+                    print("Could not send live concentrations:", str(e))
+        if stop:
+            return
+
+
+def record_data(record_filename, stream_url=None):
     """
-    Captures ADC data and writes it to a CSV file.
-    
+    Records raw frames to a binary file until the stop signal is received.
+    Frames are buffered and written in chunks (see session_recorder.py), so
+    there is no per-frame write, flush or print. Use export_csv() to produce
+    the all_groups.csv layout afterwards.
+
     Parameters:
-      csv_filename (str): Name of the CSV file to write the data.
-      stop_on_enter (bool): If True, the loop will check for the Enter key to stop logging.
-      external_stop_flag: An object (e.g., threading.Event) with an is_set() method.
-                          If provided and external_stop_flag.is_set() returns True,
-                          the capture loop will stop.
+      record_filename (str): Name of the binary recording file.
+      stream_url (str): If given, frames are also processed on-line
+                        (see streaming_pipeline.py) in a worker thread and
+                        the latest concentrations are emitted as
+                        'live_concentrations' to the Socket.IO server
+                        at this URL.
     """
     global STOP_FLAG
     STOP_FLAG = False  # Reset the flag at the start
 
-    with open(csv_filename, mode='w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        header = ["Time (s)"]
-        for i in range(8):
-            header += [f"G{i}_Short", f"G{i}_Long1", f"G{i}_Long2", f"G{i}_Emitter"]
-        writer.writerow(header)
-
-        print("Starting raw ADC logging (seconds elapsed)...")
-        if stop_on_enter:
-            print("Press Enter to stop logging and proceed to CSV processing.")
-
-        start_time = time.time()
+    client, streamer, frame_queue = None, None, queue.Queue()
+    if stream_url:
+        client = socketio.Client()
+        try:
+            client.connect(stream_url, transports=['websocket'])
+            streamer = threading.Thread(target=stream_concentrations,
+                                        args=(frame_queue, StreamingProcessor(), client),
+                                        daemon=True)
+            streamer.start()
+        except Exception as e:
+            print(f"Live concentrations disabled, could not connect to {stream_url}:", str(e))
 
+    synchronizer = FrameSynchronizer()
+    print("Starting raw ADC recording...")
+    with SessionRecorder(record_filename) as recorder:
         try:
-            while True:
-                if STOP_FLAG:
-                    print("Stop flag detected. Stopping capture...")
-                    break
-                data = ser.read(64)
-                if len(data) == 64:
-                    parsed_data = parse_packet(data)
-                    elapsed_time = round(time.time() - start_time, 3)
-                    flat_row = [elapsed_time]
-                    for i in range(8):
-                        flat_row += parsed_data[i][1:5].tolist()
-                    writer.writerow(flat_row)
-                    csvfile.flush()
-                    print(f"{elapsed_time}s - Logged frame to CSV.")
-                else:
-                    print("No valid data received from the serial port.")
-                    time.sleep(0.1)
+            while not STOP_FLAG:
+                data = ser.read(ser.in_waiting or PACKET_SIZE)
+                blocks = synchronizer.feed(data)
+                recorder.write_frames(blocks)
+                if streamer is not None and blocks:
+                    # The blocks are views into the synchronizer's buffer.
+                    frame_queue.put([bytes(block) for block in blocks])
+            print("Stop flag detected. Stopping capture...")
         except Exception as e:
-            print("An error occurred during logging:", str(e))
+            print("An error occurred during recording:", str(e))
+
+    if streamer is not None:
+        frame_queue.put(None)
+        streamer.join()
+    if client is not None and client.connected:
+        client.disconnect()
+    print(f"Recorded {recorder.frames_written} frames to '{record_filename}'.")
+    print(f"Frame synchronization: {synchronizer.stats()}")
 
 
 def interleave_mode_blocks(df, mode_col="G0_Emitter"):
@@ -239,102 +293,37 @@ def interleave_mode_blocks(df, mode_col="G0_Emitter"):
     The function assumes that the DataFrame has a column named mode_col
     that indicates the mode (1 or 2) for each row.
     It creates a new DataFrame where each block of mode 1 rows is interleaved
-    with the following block of mode 2 rows.
+    with the following block of mode 2 rows. The shorter block of each pair
+    is padded by repeating its last row; a leftover unpaired block is dropped.
+
+    The row order is computed as a NumPy index array and applied with a
+    single `take`; the input DataFrame is not modified.
     """
-    # Create groups based on changes in the mode column
-    df["group"] = (df[mode_col] != df[mode_col].shift()).cumsum()
+    mode = df[mode_col].to_numpy()
+    num_rows = len(mode)
+    if num_rows == 0:
+        return df.reset_index(drop=True)
 
-    # Collect each group into a list of DataFrames
-    blocks = []
-    for _, block_df in df.groupby("group"):
-        block_df = block_df.drop(columns="group")
-        blocks.append(block_df)
+    # Start/end rows of each block of constant mode.
+    starts = np.concatenate(([0], np.flatnonzero(mode[1:] != mode[:-1]) + 1))
+    ends = np.append(starts[1:], num_rows)
 
-    all_rows = []
-    i = 0
     # Process blocks in pairs; discard any leftover block if it exists.
-    while i < len(blocks) - 1:
-        block1 = blocks[i].reset_index(drop=True)
-        block2 = blocks[i + 1].reset_index(drop=True)
-
-        n1, n2 = len(block1), len(block2)
-        max_len = max(n1, n2)
-
-        for j in range(max_len):
-            # Get row from block1; if out of range, repeat the last row
-            row1 = block1.loc[j] if j < n1 else block1.loc[n1 - 1]
-            # Get row from block2; if out of range, repeat the last row
-            row2 = block2.loc[j] if j < n2 else block2.loc[n2 - 1]
-
-            all_rows.append(row1.copy())
-            all_rows.append(row2.copy())
-
-        i += 2
-
-    final_df = pd.DataFrame(all_rows)
-    if "group" in final_df.columns:
-        final_df.drop(columns="group", inplace=True)
-    return final_df
-
-def build_channel_info(age, sd_short, sd_long):
-    """
-    Builds channel names, wavelengths, DPFs, and source-detector distances.
-    There are 24 physical channels (8 sensor groups × 3 detectors), and each is
-    measured at two wavelengths (660 nm and 940 nm), yielding 48 channels.
-    """
-    physical_channels = [f"S{s}_D{d}"
-                         for s in range(1, 9)      # sets 1–8
-                         for d in (1, 2, 3)]       # detectors 1-3
-    channel_names, ch_wls, ch_dpfs, ch_distances = [], [], [], []
-    for name in physical_channels:
-        det_num = int(name.split("_D")[1])
-        dist    = sd_short if det_num == 1 else sd_long
-        # 660nm
-        channel_names.append(name)
-        ch_wls.append(660.0)
-        ch_dpfs.append(nsp.get_dpf(660.0, age))
-        ch_distances.append(dist)
-        # 940nm
-        channel_names.append(name)
-        ch_wls.append(940.0)
-        ch_dpfs.append(nsp.get_dpf(940.0, age))
-        ch_distances.append(dist)
-    return channel_names, ch_wls, ch_dpfs, ch_distances
-
-def combine_two_rows(row_mode1, row_mode2):
-    """
-    Combines two rows (one for mode=1 and the next for mode=2) from the CSV
-    into a 48-element sample.
-
-    Each row is assumed to have the following structure:
-      [Time, G0_Short, G0_Long1, G0_Long2, G0_Emitter,
-             G1_Short, G1_Long1, G1_Long2, G1_Emitter, ...,
-             G7_Short, G7_Long1, G7_Long2, G7_Emitter]
-
-    For each sensor group (0 through 7), we extract the three measurements from
-    the mode=1 row (assumed to be 660 nm) and the three from the mode=2 row (assumed to be 940 nm),
-    then interleave them to form a 48-element vector:
-      [short_660, short_940, long1_660, long1_940, long2_660, long2_940] for each group.
-    """
-    sample = np.zeros(48, dtype=float)
-    # There are 8 groups; each group occupies 4 columns (excluding the time)
-    for g in range(8):
-        # For mode 1 row (660 nm):
-        short_660 = float(row_mode1[1 + 4*g])
-        long1_660 = float(row_mode1[2 + 4*g])
-        long2_660 = float(row_mode1[3 + 4*g])
-        # For mode 2 row (940 nm):
-        short_940 = float(row_mode2[1 + 4*g])
-        long1_940 = float(row_mode2[2 + 4*g])
-        long2_940 = float(row_mode2[3 + 4*g])
-        base = g * 6
-        sample[base + 0] = short_660
-        sample[base + 1] = short_940
-        sample[base + 2] = long1_660
-        sample[base + 3] = long1_940
-        sample[base + 4] = long2_660
-        sample[base + 5] = long2_940
-    return sample
+    num_pairs = len(starts) // 2
+    start1, end1 = starts[0:2 * num_pairs:2], ends[0:2 * num_pairs:2]
+    start2, end2 = starts[1:2 * num_pairs:2], ends[1:2 * num_pairs:2]
+    len1, len2 = end1 - start1, end2 - start2
+    pair_len = np.maximum(len1, len2)
+
+    # Position j within its pair for every output row pair.
+    pair_ids = np.repeat(np.arange(num_pairs), pair_len)
+    j = np.arange(pair_len.sum()) - np.repeat(np.cumsum(pair_len) - pair_len, pair_len)
+
+    # Rows past the end of a block repeat that block's last row.
+    order = np.empty(2 * len(j), dtype=int)
+    order[0::2] = start1[pair_ids] + np.minimum(j, len1[pair_ids] - 1)
+    order[1::2] = start2[pair_ids] + np.minimum(j, len2[pair_ids] - 1)
+    return df.take(order).reset_index(drop=True)
 
 def process_csv_dataset(
     input_csv,
@@ -371,28 +360,41 @@ def process_csv_dataset(
 
     # Convert rows to float arrays
     data_matrix = np.array([[float(x) for x in line] for line in data_lines if len(line) >= 33])
+    process_dataset(data_matrix, output_csv, age, sd_short, sd_long, molar_ext_coeff_table,
+                    bp_low, bp_high, bp_order)
+
+def process_dataset(
+    data_matrix,
+    output_csv,
+    age=22,
+    sd_short=0.6,
+    sd_long=3.5,
+    molar_ext_coeff_table='wray',
+    bp_low=0.05,
+    bp_high=0.1,
+    bp_order=4,
+    bandpass_workers=None
+):
+    """
+    Processes interleaved rows already in memory, as an (N, 33) float array
+    in the CSV layout of process_csv_dataset, and writes `output_csv`.
+    `bandpass_workers` is passed to smart_bandpass as `workers`.
+    """
     num_rows = data_matrix.shape[0]
     if num_rows < 2:
         print("Insufficient data rows for processing.")
         return
 
-    # Pair rows: assume row0 is mode1, row1 is mode2, row2 is mode1, etc.
-    samples = []
-    times = []
-    i = 0
-    while i < num_rows - 1:
-        row_mode1 = data_matrix[i, :]
-        row_mode2 = data_matrix[i+1, :]
-        t_val = row_mode1[0]  # use the timestamp from the mode1 row
-        sample = combine_two_rows(row_mode1, row_mode2)
-        samples.append(sample)
-        times.append(t_val)
-        i += 2
-
-    samples = np.array(samples).T  # shape: (48, N)
-
     # Build channel information from established models
-    channel_names, ch_wls, ch_dpfs, ch_distances = build_channel_info(age, sd_short, sd_long)
+    channel_names, ch_wls, _, _ = build_channel_info(age, sd_short, sd_long)
+
+    # Pair rows: assume row0 is mode1, row1 is mode2, row2 is mode1, etc.
+    # An odd trailing row has no partner and is dropped.
+    num_pairs = num_rows // 2
+    pairs = data_matrix[:2 * num_pairs].reshape(num_pairs, 2, data_matrix.shape[1])
+    times = pairs[:, 0, 0]  # use the timestamp from the mode1 row
+    row_indices, column_indices = build_pair_indices(channel_names, ch_wls)
+    samples = pairs[:, row_indices, column_indices].T  # shape: (48, N)
 
     # Apply OD conversion to the entire dataset
     delta_od = nsp.intensities_to_od_changes(samples)
@@ -401,18 +403,13 @@ def process_csv_dataset(
     # High-pass ≥ 0.1 Hz to drop drifts; low-pass ≤ 0.05 Hz to drop pulse & noise.
     dt  = np.mean(np.diff(times))
     fs  = 1.0 / dt
-    delta_od_filt = smart_bandpass(delta_od, fs, lowcut=bp_low, highcut=bp_high, order=bp_order)
-
-    # Apply MBLL to compute concentration changes
-    delta_c, new_ch_names, new_ch_types = nsp.mbll(
-        delta_od_filt,
-        channel_names,
-        ch_wls,
-        ch_dpfs,
-        ch_distances,
-        unit='cm',
-        table=molar_ext_coeff_table
-    )
+    delta_od_filt = smart_bandpass(delta_od, fs, lowcut=bp_low, highcut=bp_high, order=bp_order,
+                                   workers=bandpass_workers)
+
+    # Apply MBLL to compute concentration changes (precomputed 2x2 operator per channel)
+    matrices = mbll_matrices(age, sd_short, sd_long, molar_ext_coeff_table)
+    delta_c = apply_mbll(delta_od_filt, matrices)
+    new_ch_names, new_ch_types = hemoglobin_channels(channel_names)
     # Apply CBSI for signal improvement
     delta_c_corr, corr_ch_names, corr_ch_types = nproc.cbsi(delta_c, new_ch_names, new_ch_types)
     # delta_c_corr is of shape (48, N)
@@ -442,23 +439,36 @@ def process_csv_dataset(
     print(tabulate(table_data, headers=["Channel", "Type", "Concentration"]))
 
 
-# ------------------ Main ------------------
-if __name__ == '__main__':
-
-    # Capture Data
-    STOP_FLAG=None # set to 1 from GUI to stop processing
-    capture_data("all_groups.csv", stop_on_enter=True)
-
-    # Read CSV file
-    df = pd.read_csv("all_groups.csv")
-
-    # Revert inversion (if needed)
-    #df = revert_inversion(df)
+def interleave_session(df, mode_col="G0_Emitter", increment=0.001):
+    """
+    Interleaves the mode blocks of `df` (see interleave_mode_blocks) and
+    assigns new timestamps at a fixed `increment`, rounded to avoid
+    floating-point artifacts, in a leading "Time (s)" column.
+    """
+    final_df = interleave_mode_blocks(df, mode_col=mode_col)
+    final_df.insert(0, "Time (s)", [i * increment for i in range(len(final_df))])
+    final_df["Time (s)"] = final_df["Time (s)"].round(3)
+    return final_df
 
+def process_session(df, interleaved_csv="interleaved_output.csv", output_csv="processed_output.csv",
+                    cutoff_hz=1.0, lowpass_order=4, increment=0.001, cache=None,
+                    age=22, sd_short=0.6, sd_long=3.5, molar_ext_coeff_table='wray',
+                    bp_low=0.05, bp_high=0.1, bp_order=4, bandpass_workers=None):
+    """
+    Runs the offline chain on a raw session in the `all_groups.csv` layout:
+    threshold, low-pass, RMS, interleaving (written to `interleaved_csv`)
+    and process_dataset (written to `output_csv`). `age` ... `bp_order`
+    and `bandpass_workers` are passed to process_dataset. `df` is modified.
+
+    If `cache` (a StageCache) is given, each stage output is looked up in
+    it first, and `interleaved_csv` is only rewritten when its content
+    changes.
+    """
     # Extract sampling rate from data
-    time = df['Time (s)']
-    dt = time.diff().mean()
+    timestamps = df['Time (s)']
+    dt = timestamps.diff().mean()
     fs = 1.0 / dt
+    input_key = frame_key(df) if cache is not None else None
 
     # Data formating and Processing
     # 1) Completely ignore the original timestamp by dropping it if it exists.
@@ -467,29 +477,82 @@ if __name__ == '__main__':
 
     # 2) Filter out raw analog data
     exclude_cols = [c for c in df.columns if 'Emitter' in c]
-    df = threshold_filter(df, exclude_columns=exclude_cols)
-    df = butter_lowpass_filter(df=df, cutoff_hz=1.0, fs=fs, order=4, exclude_columns=exclude_cols)
 
-    # 3) Convert raw analog data to intensities
-    df = sliding_window_rms(df=df)
+    # Each stage is (name, keyword arguments, function); see run_stages.
+    stages = [
+        ('threshold', {'exclude_columns': exclude_cols, 'inplace': True}, threshold_filter),
+        ('lowpass', {'cutoff_hz': cutoff_hz, 'fs': quantize(fs), 'order': lowpass_order,
+                     'exclude_columns': exclude_cols, 'inplace': True}, butter_lowpass_filter),
+        # 3) Convert raw analog data to intensities
+        ('rms', {'remove_dc': False, 'split_segments_in_half': False}, sliding_window_rms),
+        # 4) Interleave the blocks based on the mode column.
+        # 5) Assign new timestamps at a fixed increment (0.001 s by default)
+        ('interleave', {'mode_col': "G0_Emitter", 'increment': increment}, interleave_session),
+    ]
+    dataset_params = {
+        'age': age,
+        'sd_short': sd_short,
+        'sd_long': sd_long,
+        'molar_ext_coeff_table': molar_ext_coeff_table,
+        'bp_low': bp_low,
+        'bp_high': bp_high,
+        'bp_order': bp_order,
+    }
+
+    # Nothing to do if the interleaved data and the final output are both cached.
+    if cache is not None:
+        interleave_key = chain_keys(cache, input_key, stages)[-1]
+        output_key = cache.key('dataset', interleave_key, dataset_params)
+        interleaved_cached = cache.output_key(interleaved_csv) == interleave_key
+        if interleaved_cached and cache.load_file(output_key, output_csv):
+            print(f"Reused cached output → '{output_csv}'.")
+            return
+
+    final_df, computed = run_stages(cache, df, input_key, stages)
+
+    # 6) Write the final DataFrame to CSV
+    if cache is None or computed or cache.output_key(interleaved_csv) != interleave_key:
+        final_df.to_csv(interleaved_csv, index=False)
+        if cache is not None:
+            cache.record_output(interleaved_csv, interleave_key)
+
+    # 7) Output the resulting DataFrame.
+    print(final_df.head(20))
 
-    # 4) Interleave the blocks based on the mode column.
-    final_df = interleave_mode_blocks(df, mode_col="G0_Emitter")
+    # 8) Process collected data
+    if cache is not None and cache.load_file(output_key, output_csv):
+        print(f"Reused cached output → '{output_csv}'.")
+        return
+    # The worker count does not change the output, so it is not part of the key.
+    process_dataset(final_df.to_numpy(dtype=float), output_csv, **dataset_params,
+                    bandpass_workers=bandpass_workers)
+    if cache is not None:
+        cache.save_file(output_key, output_csv)
 
-    # 5) Assign new timestamps at a fixed increment (0.001 s in this example)
-    INCREMENT = 0.001
-    final_df.insert(0, "Time (s)", [i * INCREMENT for i in range(len(final_df))])
 
-    # 6) Round the new timestamps to avoid floating-point artifacts.
-    final_df["Time (s)"] = final_df["Time (s)"].round(3)
+# ------------------ Main ------------------
+if __name__ == '__main__':
 
-    # 7) Write the final DataFrame to CSV
-    final_df.to_csv("interleaved_output.csv", index=False)
+    ser = serial.Serial(SERIAL_PORT, baudrate=BAUD_RATE, timeout=TIMEOUT)
 
-    # 8) Output the resulting DataFrame.
-    print(final_df.head(20))
+    # Capture Data
+    STOP_FLAG=None # set to 1 from GUI to stop processing
+    # Stream live concentrations to the visualizer only if asked ('stream')
+    record_data("all_groups.bin", stream_url=STREAM_URL if STREAM else None)
+    if CHUNKED:
+        # Same result as process_session, without holding the session in
+        # memory (no all_groups.csv export: use export_csv() if needed)
+        process_recording_chunked("all_groups.bin", "processed_output.csv")
+        sys.exit(0)
+
+    export_csv("all_groups.bin", "all_groups.csv")
+
+    # Read the recording through a memory map (no CSV parsing)
+    df = SessionReader("all_groups.bin").to_dataframe()
+
+    # Revert inversion (if needed)
+    #df = revert_inversion(df)
 
-    # 9) Process collected data
-    INPUT_CSV = "interleaved_output.csv"  
-    OUTPUT_CSV = "processed_output.csv"
-    process_csv_dataset(INPUT_CSV, OUTPUT_CSV)
+    # No stage cache: a fresh recording never matches an earlier run (use
+    # batch_processing.py --cache-dir to reprocess sessions with new settings)
+    process_session(df)
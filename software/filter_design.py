@@ -0,0 +1,107 @@
+"""
+filter_design.py
+==================
+This module caches the filter designs used by the processing pipeline.
+Butterworth SOS coefficients and the polyphase FIR kernels used by
+`resample_poly` are designed once per parameter set and reused, so
+processing a session chunk by chunk (or epoch by epoch) does not redesign
+the same filters on every call.
+
+Parameters are quantized to QUANTIZE_DIGITS significant digits before
+they are used as cache keys *and* for the design itself, so a sampling
+rate estimated from slightly jittery timestamps always yields the same
+coefficients.
+"""
+
+from functools import lru_cache
+from math import gcd
+import numpy as np
+from scipy.signal import butter, firwin, sosfilt
+
+QUANTIZE_DIGITS = 6
+CACHE_SIZE = 64
+
+
+def quantize(value, digits=QUANTIZE_DIGITS):
+    """
+    Round `value` to `digits` significant digits.
+    """
+    return float(f"{float(value):.{digits}g}")
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _butter_sos(order, cutoff, fs, btype):
+    nyquist = 0.5 * fs
+    if isinstance(cutoff, tuple):
+        normal_cutoff = [c / nyquist for c in cutoff]
+    else:
+        normal_cutoff = cutoff / nyquist
+    return butter(order, normal_cutoff, btype=btype, analog=False, output='sos')
+
+
+def butter_sos(order, cutoff, fs, btype='low'):
+    """
+    Return (cached) Butterworth coefficients in second-order sections.
+    `cutoff` is in Hz: a single frequency, or a (low, high) pair for
+    band-pass/band-stop filters. A copy of the cached array is returned
+    because sosfilt needs writable coefficients.
+    """
+    if isinstance(cutoff, (tuple, list)):
+        cutoff = tuple(quantize(c) for c in cutoff)
+    else:
+        cutoff = quantize(cutoff)
+    return _butter_sos(int(order), cutoff, quantize(fs), btype).copy()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _resample_kernel(max_rate, window):
+    half_len = 10 * max_rate
+    kernel = firwin(2 * half_len + 1, 1.0 / max_rate, window=window)
+    kernel.flags.writeable = False  # Shared; resample_poly copies it before use
+    return kernel
+
+
+def resample_kernel(up, down, window=('kaiser', 5.0)):
+    """
+    Return the (cached) anti-aliasing FIR kernel that `resample_poly` designs
+    for the given rates. Passing it as `resample_poly(..., window=kernel)`
+    gives the same result as the default design without redoing it.
+    """
+    # The design only depends on the larger of the reduced rates.
+    divisor = gcd(up, down)
+    return _resample_kernel(max(up, down) // divisor, window)
+
+
+def settling_samples(sos, tol=1e-12, max_samples=1 << 22):
+    """
+    Return the number of samples after which the impulse response of `sos`
+    stays below `tol` times its peak. Used as the overlap when a filter is
+    applied chunk by chunk.
+    """
+    length = 1024
+    while True:
+        impulse = np.zeros(length)
+        impulse[0] = 1.0
+        response = np.abs(sosfilt(sos, impulse))
+        last = int(np.flatnonzero(response > tol * response.max())[-1]) + 1
+        if last <= length // 2 or length >= max_samples:
+            return last
+        length *= 2
+
+
+def resample_margin(up, down, window=('kaiser', 5.0)):
+    """
+    Return the number of low-rate samples on each side of a chunk that
+    affect `resample_poly(..., up, down)` inside it, i.e. the overlap that
+    makes chunked resampling identical to resampling the whole signal.
+    """
+    half_len = len(resample_kernel(up, down, window)) // 2
+    return -(-(half_len + 1) // max(up, down)) + 1
+
+
+def clear_cache():
+    """
+    Discard all cached filter designs.
+    """
+    _butter_sos.cache_clear()
+    _resample_kernel.cache_clear()
@@ -0,0 +1,78 @@
+"""
+geometry_cache.py
+==================
+This module stores the precomputed brain geometry of visualizer.py (mesh
+vertices, triangles and normals, sensor regions, and the surface points and
+vertex labels of every region) in a single .npz file, so a warm start skips
+parsing the mesh and the AAL atlas and all the KD-tree work.
+
+The entry is keyed by the SHA-256 of the input files, the sensor layout and
+GEOMETRY_VERSION: changing any of them invalidates it, and it is recomputed
+and overwritten on the next start.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import numpy as np
+
+DEFAULT_PATH = "brain_geometry_cache.npz"
+GEOMETRY_VERSION = 3   # Bump when the stored geometry changes
+READ_CHUNK = 1 << 20   # Bytes per read when hashing input files
+
+
+def file_digest(path):
+    """
+    Return the SHA-256 hex digest of the contents of `path`.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_CHUNK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def geometry_key(input_files, layout):
+    """
+    Return the key of the geometry computed from `input_files` (paths) with
+    the sensor `layout` (a dict of JSON-serializable values or arrays).
+    """
+    layout = {name: np.asarray(value).tolist() for name, value in layout.items()}
+    description = json.dumps([GEOMETRY_VERSION, [file_digest(p) for p in input_files], layout],
+                             sort_keys=True)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+def load_geometry(key, path=DEFAULT_PATH):
+    """
+    Return the arrays stored in `path` as a dict, or None if the file is
+    missing, unreadable or was stored under another key.
+    """
+    try:
+        with np.load(path, allow_pickle=False) as entry:
+            if str(entry['key']) != key:
+                return None
+            return {name: entry[name] for name in entry.files if name != 'key'}
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def save_geometry(key, arrays, path=DEFAULT_PATH):
+    """
+    Store `arrays` (a dict of numpy arrays) in `path` under `key`.
+    Failures are logged and ignored: the cache is only an optimization.
+    """
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    except OSError as e:
+        logging.warning(f"Could not write the geometry cache '{path}': {e}")
+        return
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, key=np.array(key), **arrays)
+        os.replace(tmp_path, path)   # Atomic, so readers never see a partial entry
+    except OSError as e:
+        logging.warning(f"Could not write the geometry cache '{path}': {e}")
+        os.remove(tmp_path)
@@ -9,10 +9,12 @@ It reads data from a CSV file and displays it in a GUI with multiple subplots.
 import sys
 import os
 import signal
-import collections
+import numpy as np
 import pandas as pd
 from PyQt5 import QtWidgets, QtCore
 import pyqtgraph as pg
+from trace_buffer import TraceBuffer
+from decimation import MinMaxDecimator
 
 # ------------------------------
 # Determine data folder
@@ -38,12 +40,18 @@ pg.setConfigOption('antialias', True)
 pg.setConfigOption('background', 'w')
 pg.setConfigOption('foreground', 'k')
 
-# Data storage: 8 groups, 6 traces per group.
-data = [[collections.deque(maxlen=5000) for _ in range(6)] for _ in range(8)]
+# Data storage: 8 groups, 6 traces per group, plus the matching timestamps.
+MAX_POINTS = 5000
+data = TraceBuffer(8, 6, MAX_POINTS)
+times = TraceBuffer(1, 1, MAX_POINTS, dtype=np.float64)
+decimator = MinMaxDecimator(data)
 
 # Load CSV data.
 df = pd.read_csv(CSV_PATH)
 n_rows = df.shape[0]
+# The 48 concentration columns after Time, as an (n_rows, 8, 6) array.
+concentrations = df.iloc[:, 1:49].to_numpy(dtype=np.float32).reshape(n_rows, 8, 6)
+time_values = df["Time"].to_numpy(dtype=np.float64)
 
 # ------------------------------
 # Set Up PyQt Application & UI
@@ -107,22 +115,16 @@ def update():
     """
     global CURRENT_INDEX
     if CURRENT_INDEX < n_rows:
-        row = df.iloc[CURRENT_INDEX]
-        for group in range(8):
-            start_idx = 1 + group * 6
-            group_values = []
-            for j in range(6):
-                group_values.append(row.iloc[start_idx + j])
-            # Append the values for each trace in this group.
-            for trace in range(6):
-                data[group][trace].append(group_values[trace])
+        data.append(concentrations[CURRENT_INDEX])
+        times.append(time_values[CURRENT_INDEX])
         CURRENT_INDEX += 1
 
         # Update each subplot.
+        positions, traces = decimator.decimate()
+        x = times.trace(0, 0)[positions]
         for group in range(8):
-            x = list(df["Time"].iloc[:len(data[group][0])])
             for trace in range(6):
-                curves[group][trace].setData(x, list(data[group][trace]))
+                curves[group][trace].setData(x, traces[group, trace])
     else:
         # Once all rows are rendered, stop the timer and quit.
         timer.stop()
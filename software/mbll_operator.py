@@ -0,0 +1,69 @@
+"""
+mbll_operator.py
+==================
+This module precomputes the Modified Beer-Lambert Law as a linear operator.
+Every source-detector pair is measured at 660 nm and 940 nm, and the pairs
+only differ by their distance, so MBLL reduces to one 2×2 matrix per pair
+(extinction-coefficient inverse scaled by 1 / (distance × DPF)). The
+matrices are built once per (age, sd_short, sd_long, table) and applied to
+all pairs and samples with a single einsum, instead of redoing the table
+lookup and inversion in `nirsimple.preprocessing.mbll` on every call.
+"""
+
+from functools import lru_cache
+import numpy as np
+import nirsimple.preprocessing as nsp
+from channel_layout import build_channel_info
+from filter_design import quantize
+
+CACHE_SIZE = 16
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _mbll_matrices(age, sd_short, sd_long, table):
+    channel_names, ch_wls, ch_dpfs, ch_distances = build_channel_info(age, sd_short, sd_long)
+    # MBLL is linear, so applying it to the identity yields its matrix.
+    num_channels = len(channel_names)
+    operator, _, _ = nsp.mbll(np.eye(num_channels), channel_names, ch_wls, ch_dpfs,
+                              ch_distances, unit='cm', table=table)
+    # Channels come in (660 nm, 940 nm) pairs, so the operator is block diagonal.
+    pairs = np.arange(num_channels // 2)
+    blocks = operator.reshape(len(pairs), 2, len(pairs), 2)[pairs, :, pairs, :]
+    blocks.flags.writeable = False  # Shared between callers
+    return blocks
+
+
+def mbll_matrices(age=22, sd_short=0.6, sd_long=3.5, table='wray'):
+    """
+    Return the (cached, read-only) MBLL operator of shape (24, 2, 2).
+    Block k maps the [660 nm, 940 nm] OD changes of source-detector pair k
+    (in build_channel_info order) to its [HbO, HbR] concentration changes.
+    """
+    return _mbll_matrices(quantize(age), quantize(sd_short), quantize(sd_long), table)
+
+
+def apply_mbll(delta_od, matrices):
+    """
+    Apply the MBLL operator to OD changes of shape (48, N) (or (48,) for a
+    single sample) ordered like build_channel_info. Returns concentration
+    changes of the same shape, ordered hbo/hbr per channel like
+    `nirsimple.preprocessing.mbll`.
+    """
+    delta_od = np.asarray(delta_od, dtype=float)
+    pairs = delta_od.reshape(len(matrices), 2, -1)
+    delta_c = np.einsum('kij,kjn->kin', matrices, pairs)
+    return delta_c.reshape(delta_od.shape)
+
+
+def hemoglobin_channels(channel_names):
+    """
+    Return the (names, types) of the rows produced by apply_mbll.
+    """
+    return list(channel_names), ['hbo', 'hbr'] * (len(channel_names) // 2)
+
+
+def clear_cache():
+    """
+    Discard all cached MBLL operators.
+    """
+    _mbll_matrices.cache_clear()
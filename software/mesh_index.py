@@ -0,0 +1,91 @@
+"""
+mesh_index.py
+==================
+This module provides MeshIndex, a KD-tree over the vertices of the brain
+mesh shared by all of visualizer.py's surface lookups: keeping the AAL
+region points close to the surface, labelling the vertices with their
+nearest region and snapping the sensors onto the mesh.
+
+Build one MeshIndex per mesh and pass it to every lookup. The lookups are
+batched: the points of all regions are queried at once, bounded by the
+distance threshold and spread over parallel workers.
+"""
+
+from itertools import chain
+import numpy as np
+from scipy.spatial import cKDTree
+
+DEFAULT_WORKERS = -1   # Query workers (-1: one per CPU)
+
+
+class MeshIndex:
+    """
+    MeshIndex answers nearest-vertex and distance-to-surface queries.
+
+    Parameters:
+      vertices (ndarray): (N, 3) vertex coordinates of the mesh.
+      workers (int): Parallel workers per query (-1: one per CPU).
+    """
+    def __init__(self, vertices, workers=DEFAULT_WORKERS):
+        self.vertices = np.asarray(vertices, dtype=float)
+        self.workers = workers
+        self.tree = cKDTree(self.vertices)
+
+    def nearest(self, points):
+        """
+        Return (distances, indices) of the vertex nearest to each point.
+        """
+        return self.tree.query(np.asarray(points, dtype=float), workers=self.workers)
+
+    def near_surface(self, points, threshold):
+        """
+        Return a boolean mask of the points within `threshold` of a vertex.
+        The search stops at `threshold`, so far points are cheap.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        distances, _ = self.tree.query(points, distance_upper_bound=threshold,
+                                       workers=self.workers)
+        return distances <= threshold
+
+    def filter_near_surface(self, point_sets, threshold):
+        """
+        Return, for every array of points in `point_sets`, the points within
+        `threshold` of the mesh. All sets are queried in a single batch.
+        """
+        if not point_sets:
+            return []
+        counts = [len(points) for points in point_sets]
+        points = np.vstack([np.asarray(p, dtype=float).reshape(-1, 3) for p in point_sets])
+        mask = self.near_surface(points, threshold)
+        bounds = np.cumsum(counts)[:-1]
+        return [p[m] for p, m in zip(np.split(points, bounds), np.split(mask, bounds))]
+
+    def label_vertices(self, point_sets, threshold):
+        """
+        Return the index (into `point_sets`) of the set holding the point
+        nearest to each vertex, or len(point_sets) for vertices farther than
+        `threshold` from every point, as uint8. Only the vertices within
+        `threshold` of a point are searched.
+        """
+        num_sets = len(point_sets)
+        labels = np.full(len(self.vertices), num_sets, dtype=np.uint8)
+        if num_sets == 0:
+            return labels
+        points = np.vstack([np.asarray(p, dtype=float).reshape(-1, 3) for p in point_sets])
+        point_labels = np.repeat(np.arange(num_sets, dtype=np.uint8),
+                                 [len(p) for p in point_sets])
+        neighbours = self.tree.query_ball_point(points, threshold, workers=self.workers,
+                                                return_sorted=False)
+        counts = np.fromiter(map(len, neighbours), dtype=np.intp, count=len(points))
+        vertex_ids = np.fromiter(chain.from_iterable(neighbours), dtype=np.intp,
+                                 count=counts.sum())
+        point_ids = np.repeat(np.arange(len(points)), counts)
+        distances = np.linalg.norm(self.vertices[vertex_ids] - points[point_ids], axis=1)
+
+        # Keep the nearest point of every vertex.
+        order = np.lexsort((distances, vertex_ids))
+        vertex_ids, point_ids = vertex_ids[order], point_ids[order]
+        first = np.ones(len(vertex_ids), dtype=bool)
+        first[1:] = vertex_ids[1:] != vertex_ids[:-1]
+        labels[vertex_ids[first]] = point_labels[point_ids[first]]
+        return labels
@@ -0,0 +1,231 @@
+"""
+packet_decoder.py
+==================
+This module decodes the raw 64-byte sensor frames sent by the ECU firmware
+(see `serial_interface_tx_send_sensor_data`). Each frame holds 8 groups of
+8 bytes:
+
+    [0xF0 | module, Short (>u2), Long1 (>u2), Long2 (>u2), Emitter Status]
+
+Instead of unpacking each group with `struct`, a whole buffer of N frames
+is viewed through a NumPy structured dtype, so thousands of frames are
+decoded in a single call. FrameSynchronizer keeps the stream aligned on the
+0xF0 | module identifier bytes so a dropped byte only costs a few frames.
+"""
+
+import numpy as np
+from ring_buffer import DEFAULT_CAPACITY, ByteRingBuffer
+
+PACKET_SIZE = 64      # Bytes per frame
+NUM_GROUPS = 8        # Sensor groups per frame
+GROUP_SIZE = 8        # Bytes per sensor group
+ZERO_LEVEL = 2050     # Mid-scale ADC level the readings are inverted around
+FRAME_RATE = 1000.0   # Frames per second (firmware TIM4 interrupt rate)
+
+# Layout of a single 8-byte sensor group (big-endian readings).
+GROUP_DTYPE = np.dtype([
+    ('group_id', 'u1'),
+    ('short', '>u2'),
+    ('long1', '>u2'),
+    ('long2', '>u2'),
+    ('emitter', 'u1'),
+])
+
+# Layout of a full 64-byte frame.
+FRAME_DTYPE = np.dtype([('groups', GROUP_DTYPE, (NUM_GROUPS,))])
+
+# Field order of the decoded (8, 5) array.
+DECODED_FIELDS = ('group_id', 'short', 'long1', 'long2', 'emitter')
+
+
+def view_frames(buffer):
+    """
+    Return a zero-copy structured view of every complete frame in `buffer`.
+
+    `buffer` can be any object supporting the buffer protocol (bytes,
+    bytearray, memoryview, ndarray). Trailing bytes that do not form a full
+    frame are ignored. The result has shape (N, 8) and dtype GROUP_DTYPE.
+    """
+    num_frames = memoryview(buffer).nbytes // PACKET_SIZE
+    groups = np.frombuffer(buffer, dtype=GROUP_DTYPE,
+                           count=num_frames * NUM_GROUPS)
+    return groups.reshape(num_frames, NUM_GROUPS)
+
+
+def invert_readings(decoded, zero_level=ZERO_LEVEL):
+    """
+    Invert the Short/Long1/Long2 columns of decoded frames around
+    `zero_level` in place (value -> 2 * zero_level - value).
+    """
+    readings = decoded[..., 1:4]
+    np.subtract(2 * zero_level, readings, out=readings)
+    return decoded
+
+
+def decode_frames(buffer, invert=False, zero_level=ZERO_LEVEL, out=None):
+    """
+    Decode every complete frame in `buffer` into an (N, 8, 5) integer array:
+       [Group ID, Short, Long1, Long2, Emitter Status].
+
+    Parameters:
+      buffer: Raw bytes holding N back-to-back 64-byte frames.
+      invert (bool): If True, the three readings are inverted around `zero_level`.
+      zero_level (int): Level used for the inversion.
+      out (ndarray): Optional preallocated (M, 8, 5) array with M >= N. The
+                     decoded frames are written into out[:N] and that view is
+                     returned, so repeated calls do not allocate.
+    """
+    groups = view_frames(buffer)
+    num_frames = groups.shape[0]
+    if out is None:
+        decoded = np.empty((num_frames, NUM_GROUPS, len(DECODED_FIELDS)), dtype=int)
+    else:
+        decoded = out[:num_frames]
+
+    for col, field in enumerate(DECODED_FIELDS):
+        decoded[:, :, col] = groups[field]
+
+    if invert:
+        invert_readings(decoded, zero_level)
+    return decoded
+
+
+def decode_blocks(blocks, invert=False, zero_level=ZERO_LEVEL):
+    """
+    Decode a list of aligned frame buffers (as returned by
+    FrameSynchronizer.feed) into a single (N, 8, 5) integer array.
+    """
+    num_frames = sum(memoryview(block).nbytes for block in blocks) // PACKET_SIZE
+    decoded = np.empty((num_frames, NUM_GROUPS, len(DECODED_FIELDS)), dtype=int)
+    pos = 0
+    for block in blocks:
+        pos += len(decode_frames(block, invert, zero_level, out=decoded[pos:]))
+    return decoded
+
+
+def parse_packet(data, invert=False, zero_level=ZERO_LEVEL):
+    """
+    Parses 64 raw bytes into an 8×5 array of sensor data:
+       [Group ID, Short, Long1, Long2, Emitter Status].
+    """
+    return decode_frames(data[:PACKET_SIZE], invert=invert, zero_level=zero_level)[0]
+
+
+# -----------------------------------------------------
+# Frame Synchronization
+# -----------------------------------------------------
+
+# Identifier byte stamped on each group by the firmware (0xF0 | module).
+FRAME_IDENTIFIERS = np.arange(NUM_GROUPS, dtype=np.uint8) | 0xF0
+IDENTIFIER_OFFSETS = np.arange(NUM_GROUPS) * GROUP_SIZE
+
+
+def valid_frame_mask(frames):
+    """
+    Return a boolean mask of the frames whose 8 identifier bytes read F0..F7.
+    `frames` is a (N, 64) uint8 array.
+    """
+    return (frames[:, ::GROUP_SIZE] == FRAME_IDENTIFIERS).all(axis=1)
+
+
+def find_frame_start(data, start=0):
+    """
+    Return the first offset >= `start` at which a complete, correctly stamped
+    frame begins in the uint8 array `data`, or -1 if there is none.
+    """
+    last = len(data) - PACKET_SIZE
+    if last < start:
+        return -1
+    candidates = np.flatnonzero(data[start:last + 1] == FRAME_IDENTIFIERS[0]) + start
+    if candidates.size == 0:
+        return -1
+    identifiers = data[candidates[:, None] + IDENTIFIER_OFFSETS]
+    matches = np.flatnonzero((identifiers == FRAME_IDENTIFIERS).all(axis=1))
+    if matches.size == 0:
+        return -1
+    return int(candidates[matches[0]])
+
+
+class FrameSynchronizer:
+    """
+    FrameSynchronizer turns an arbitrary stream of serial chunks into
+    aligned 64-byte frames. Each frame is checked against the F0..F7
+    identifier pattern; when a byte is dropped the misaligned frame is
+    rejected and the stream is rescanned for the next valid frame.
+    Unread bytes are kept in a preallocated ByteRingBuffer.
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.buffer = ByteRingBuffer(capacity)
+        self.locked = False
+        self.frames_received = 0
+        self.frames_rejected = 0
+        self.bytes_discarded = 0
+        self.resync_count = 0
+        self._skipped = 0  # bytes dropped since the lock was lost
+
+    def feed(self, chunk):
+        """
+        Append `chunk` to the stream and return a list of contiguous
+        memoryviews, each holding one or more aligned frames (usually a
+        single view; more only if the stream was resynchronized). The views
+        point into the ring buffer and stay valid until the next call.
+        """
+        self.buffer.write(chunk)
+        view = self.buffer.peek()
+        data = np.frombuffer(view, dtype=np.uint8)
+        end = len(data)
+        pos = 0
+        blocks = []
+
+        while end - pos >= PACKET_SIZE:
+            if not self.locked:
+                found = find_frame_start(data, pos)
+                if found < 0:
+                    # Keep the last bytes in case a frame starts there.
+                    self._discard(end - PACKET_SIZE + 1 - pos)
+                    pos = end - PACKET_SIZE + 1
+                    break
+                self._discard(found - pos)
+                pos = found
+                self._relock()
+
+            num_frames = (end - pos) // PACKET_SIZE
+            frames = data[pos:pos + num_frames * PACKET_SIZE].reshape(num_frames, PACKET_SIZE)
+            invalid = np.flatnonzero(~valid_frame_mask(frames))
+            num_valid = int(invalid[0]) if invalid.size else num_frames
+            if num_valid:
+                blocks.append(view[pos:pos + num_valid * PACKET_SIZE])
+                self.frames_received += num_valid
+                pos += num_valid * PACKET_SIZE
+            if invalid.size:
+                # Misaligned frame: drop its first byte and rescan from there.
+                self.locked = False
+                self.resync_count += 1
+                self._discard(1)
+                pos += 1
+
+        self.buffer.consume(pos)
+        return blocks
+
+    def _discard(self, num_bytes):
+        self.bytes_discarded += num_bytes
+        self._skipped += num_bytes
+
+    def _relock(self):
+        if self._skipped:
+            self.frames_rejected += -(-self._skipped // PACKET_SIZE)
+        self._skipped = 0
+        self.locked = True
+
+    def stats(self):
+        """
+        Return the synchronization counters as a dictionary.
+        """
+        return {
+            'frames_received': self.frames_received,
+            'frames_rejected': self.frames_rejected,
+            'bytes_discarded': self.bytes_discarded,
+            'resync_count': self.resync_count,
+            'buffer_high_water_mark': self.buffer.high_water_mark,
+            'buffer_bytes_overflowed': self.buffer.bytes_overflowed,
+        }
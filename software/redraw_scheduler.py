@@ -0,0 +1,106 @@
+"""
+redraw_scheduler.py
+==================
+This module provides RedrawScheduler, which drives the redraws of the live
+pyqtgraph windows. Curves are only redrawn when the TraceBuffer they plot
+has changed, the refresh rate is capped at the display rate, and the timer
+interval adapts to the measured frame time so drawing never starves the
+data thread. The frame time covers the whole event-loop turn of a redraw:
+the setData callbacks and the Qt paint they trigger.
+"""
+
+from PyQt5 import QtCore, QtGui
+
+DEFAULT_REFRESH_RATE = 60.0   # Hz, used if the screen rate is unknown
+MAX_INTERVAL_MS = 500         # Slowest refresh the scheduler backs off to
+
+
+def display_refresh_rate(default=DEFAULT_REFRESH_RATE):
+    """
+    Return the refresh rate (Hz) of the primary screen, or `default`.
+    """
+    screen = QtGui.QGuiApplication.primaryScreen()
+    if screen is None:
+        return default
+    rate = screen.refreshRate()
+    return rate if rate > 0 else default
+
+
+class RedrawScheduler(QtCore.QObject):
+    """
+    RedrawScheduler calls the redraw callback of every watched buffer whose
+    `version` changed since its last redraw.
+
+    Parameters:
+      max_fps (float): Upper bound on the refresh rate. Defaults to the
+                       display refresh rate.
+      busy_fraction (float): Largest fraction of the GUI thread's time that
+                             may be spent redrawing. The interval is stretched
+                             to frame_time / busy_fraction when frames get slow.
+    """
+    def __init__(self, max_fps=None, busy_fraction=0.5, parent=None):
+        super().__init__(parent)
+        if max_fps is None:
+            max_fps = display_refresh_rate()
+        self.min_interval_ms = 1000.0 / max_fps
+        self.busy_fraction = busy_fraction
+        self.frame_time_ms = None  # Smoothed time spent per redraw, painting included
+        self._watched = []         # [buffer, callback, last drawn version]
+        self._frame_clock = QtCore.QElapsedTimer()
+        self._measuring = False    # A redraw is being timed
+        self._timer = QtCore.QTimer(self)
+        self._timer.timeout.connect(self._on_timeout)
+
+    def watch(self, buffer, callback):
+        """
+        Call `callback()` on the next frame after `buffer.version` changes.
+        """
+        self._watched.append([buffer, callback, None])
+
+    def start(self):
+        """
+        Start the redraw timer at the capped display rate.
+        """
+        self._timer.start(int(round(self.min_interval_ms)))
+
+    def stop(self):
+        """
+        Stop the redraw timer.
+        """
+        self._timer.stop()
+
+    def interval(self):
+        """
+        Return the current redraw interval in milliseconds.
+        """
+        return self._timer.interval()
+
+    def _on_timeout(self):
+        if not self._measuring:
+            self._frame_clock.start()
+        redrawn = False
+        for entry in self._watched:
+            buffer, callback, version = entry
+            if buffer.version != version:
+                entry[2] = buffer.version
+                callback()
+                redrawn = True
+        if redrawn and not self._measuring:
+            # A zero-delay timer fires once the event loop has processed the
+            # events already queued, including the repaints requested by the
+            # callbacks, so it closes the measurement after the paint.
+            self._measuring = True
+            QtCore.QTimer.singleShot(0, self._on_frame_done)
+
+    def _on_frame_done(self):
+        self._measuring = False
+        elapsed_ms = self._frame_clock.nsecsElapsed() / 1e6
+        if self.frame_time_ms is None:
+            self.frame_time_ms = elapsed_ms
+        else:
+            self.frame_time_ms = 0.8 * self.frame_time_ms + 0.2 * elapsed_ms
+
+        interval = max(self.min_interval_ms, self.frame_time_ms / self.busy_fraction)
+        interval = int(round(min(interval, MAX_INTERVAL_MS)))
+        if interval != self._timer.interval():
+            self._timer.setInterval(interval)
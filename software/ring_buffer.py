@@ -0,0 +1,80 @@
+"""
+ring_buffer.py
+==================
+This module provides a preallocated byte buffer for the serial readers.
+Incoming chunks are copied into a fixed bytearray and the unread bytes are
+handed out as a single contiguous memoryview, so the frame decoder can view
+many frames at once without concatenating or re-slicing `bytes` objects.
+"""
+
+DEFAULT_CAPACITY = 64 * 1024  # 1024 frames of 64 bytes
+
+
+class ByteRingBuffer:
+    """
+    ByteRingBuffer stores unread serial bytes in a preallocated bytearray.
+    When a write would run past the end, the (small) unread tail is moved
+    back to the front so the unread region always stays contiguous. If the
+    reader falls so far behind that the buffer fills up, the oldest bytes
+    are dropped and counted in `bytes_overflowed`.
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._data = bytearray(capacity)
+        self._view = memoryview(self._data)
+        self._read = 0
+        self._write = 0
+        self.high_water_mark = 0
+        self.bytes_overflowed = 0
+
+    def __len__(self):
+        return self._write - self._read
+
+    def write(self, chunk):
+        """
+        Copy `chunk` into the buffer. Views returned by peek() before this
+        call may be invalidated.
+        """
+        size = len(chunk)
+        if size > self.capacity:
+            self.bytes_overflowed += size - self.capacity
+            chunk = memoryview(chunk)[size - self.capacity:]
+            size = self.capacity
+        if self._write + size > self.capacity:
+            overflow = len(self) + size - self.capacity
+            if overflow > 0:
+                self._drop(overflow)
+            self._compact()
+        self._view[self._write:self._write + size] = chunk
+        self._write += size
+        self.high_water_mark = max(self.high_water_mark, len(self))
+
+    def peek(self):
+        """
+        Return a contiguous memoryview of all unread bytes.
+        """
+        return self._view[self._read:self._write]
+
+    def consume(self, num_bytes):
+        """
+        Mark the first `num_bytes` unread bytes as read.
+        """
+        self._read += min(num_bytes, len(self))
+        if self._read == self._write:
+            self._read = self._write = 0
+
+    def clear(self):
+        """
+        Discard all unread bytes.
+        """
+        self._read = self._write = 0
+
+    def _drop(self, num_bytes):
+        num_bytes = min(num_bytes, len(self))
+        self._read += num_bytes
+        self.bytes_overflowed += num_bytes
+
+    def _compact(self):
+        unread = len(self)
+        self._data[:unread] = self._data[self._read:self._write]
+        self._read, self._write = 0, unread
@@ -0,0 +1,236 @@
+"""
+session_recorder.py
+==================
+This module records raw sensor frames to a compact binary file, reads
+recordings back through a memory map, and exports them to the
+`all_groups.csv` layout used by the processing pipeline.
+
+File layout:
+    HEADER_DTYPE (32 bytes): magic, format version, record size, start time
+    RECORD_DTYPE × N (72 bytes each): monotonic timestamp (s) + raw 64-byte frame
+
+Records are collected in a preallocated chunk and written one chunk at a
+time, with an fsync at most every `fsync_interval` seconds, so recording
+keeps up with the USB CDC rate without a syscall per frame.
+"""
+
+import os
+import time
+import numpy as np
+import pandas as pd
+from packet_decoder import DECODED_FIELDS, FRAME_DTYPE, NUM_GROUPS, ZERO_LEVEL
+
+MAGIC = b"FNIRSREC"
+FORMAT_VERSION = 1
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('record_size', '<u4'),
+    ('start_time', '<f8'),   # Wall-clock time (time.time()) when recording started
+    ('reserved', 'V8'),
+])
+
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),    # Seconds since the start of the recording
+    ('frame', FRAME_DTYPE),
+])
+
+CSV_CHUNK_RECORDS = 65536
+
+
+def csv_header():
+    """
+    Return the column names of the `all_groups.csv` layout.
+    """
+    header = ["Time (s)"]
+    for i in range(NUM_GROUPS):
+        header += [f"G{i}_Short", f"G{i}_Long1", f"G{i}_Long2", f"G{i}_Emitter"]
+    return header
+
+
+class SessionRecorder:
+    """
+    SessionRecorder appends raw frames and their timestamps to a binary
+    recording file.
+
+    Parameters:
+      path (str): Output file; it is overwritten.
+      chunk_records (int): Number of records buffered before each write.
+      fsync_interval (float): Minimum seconds between fsync calls.
+    """
+    def __init__(self, path, chunk_records=1024, fsync_interval=1.0):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.frames_written = 0
+        self._file = open(path, 'wb')
+        self._chunk = np.empty(chunk_records, dtype=RECORD_DTYPE)
+        self._fill = 0
+        self._start = time.monotonic()
+        self._last_fsync = self._start
+
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['version'] = FORMAT_VERSION
+        header['record_size'] = RECORD_DTYPE.itemsize
+        header['start_time'] = time.time()
+        self._file.write(header.tobytes())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write_frames(self, blocks, timestamp=None):
+        """
+        Append the aligned frames in `blocks` (buffers holding whole 64-byte
+        frames, e.g. from FrameSynchronizer.feed). All frames of one call
+        share `timestamp`, which defaults to the time since the recorder
+        was created.
+        """
+        if timestamp is None:
+            timestamp = time.monotonic() - self._start
+        for block in blocks:
+            frames = np.frombuffer(block, dtype=FRAME_DTYPE)
+            pos = 0
+            while pos < len(frames):
+                count = min(len(frames) - pos, len(self._chunk) - self._fill)
+                target = self._chunk[self._fill:self._fill + count]
+                target['timestamp'] = timestamp
+                target['frame'] = frames[pos:pos + count]
+                self._fill += count
+                pos += count
+                if self._fill == len(self._chunk):
+                    self.flush()
+            self.frames_written += len(frames)
+
+    def flush(self, fsync=False):
+        """
+        Write the buffered records to the file. The file is fsynced if
+        `fsync` is True or `fsync_interval` has elapsed since the last one.
+        """
+        if self._fill:
+            self._file.write(self._chunk[:self._fill].tobytes())
+            self._fill = 0
+        now = time.monotonic()
+        if fsync or now - self._last_fsync >= self.fsync_interval:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+
+    def close(self):
+        """
+        Flush all buffered records, fsync and close the file.
+        """
+        if self._file.closed:
+            return
+        self.flush(fsync=True)
+        self._file.close()
+
+
+def records_to_rows(records, invert=True, zero_level=ZERO_LEVEL):
+    """
+    Convert recorded frames to rows of the `all_groups.csv` layout:
+    an (N, 33) float array of [Time, G0_Short, G0_Long1, G0_Long2, G0_Emitter, ...].
+    """
+    groups = records['frame']['groups']
+    readings = np.empty((len(records), NUM_GROUPS, 4), dtype=float)
+    for col, field in enumerate(DECODED_FIELDS[1:]):
+        readings[:, :, col] = groups[field]
+    if invert:
+        np.subtract(2 * zero_level, readings[..., :3], out=readings[..., :3])
+    rows = np.empty((len(records), 1 + NUM_GROUPS * 4), dtype=float)
+    rows[:, 0] = np.round(records['timestamp'], 3)
+    rows[:, 1:] = readings.reshape(len(records), -1)
+    return rows
+
+
+class SessionReader:
+    """
+    SessionReader memory-maps a binary recording and exposes its records as
+    a NumPy structured array (RECORD_DTYPE). Nothing is parsed or loaded up
+    front: slicing, including by time range, only touches the pages of the
+    records actually used. A trailing partial record (e.g. after a crash)
+    is ignored.
+    """
+    def __init__(self, path):
+        self.path = path
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+        if len(header) == 0 or header['magic'][0] != MAGIC:
+            raise ValueError(f"{path} is not an fNIRS recording")
+        if header['record_size'][0] != RECORD_DTYPE.itemsize:
+            raise ValueError(f"{path} has an unsupported record size")
+        self.version = int(header['version'][0])
+        self.start_time = float(header['start_time'][0])
+
+        num_records = (os.path.getsize(path) - HEADER_DTYPE.itemsize) // RECORD_DTYPE.itemsize
+        if num_records > 0:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode='r',
+                                     offset=HEADER_DTYPE.itemsize, shape=(num_records,))
+        else:
+            self.records = np.empty(0, dtype=RECORD_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def timestamps(self):
+        """
+        Seconds since the start of the recording, one per frame (a view).
+        """
+        return self.records['timestamp']
+
+    @property
+    def duration(self):
+        """
+        Time (s) between the first and last recorded frame.
+        """
+        if len(self.records) == 0:
+            return 0.0
+        return float(self.records['timestamp'][-1] - self.records['timestamp'][0])
+
+    def index_range(self, start_time=None, end_time=None):
+        """
+        Return the (start, stop) record indices covering
+        start_time <= timestamp < end_time, found by binary search.
+        """
+        timestamps = self.timestamps
+        start = 0 if start_time is None else int(np.searchsorted(timestamps, start_time, 'left'))
+        stop = (len(timestamps) if end_time is None
+                else int(np.searchsorted(timestamps, end_time, 'left')))
+        return start, stop
+
+    def time_slice(self, start_time=None, end_time=None):
+        """
+        Return the records with start_time <= timestamp < end_time as a view.
+        """
+        start, stop = self.index_range(start_time, end_time)
+        return self.records[start:stop]
+
+    def to_dataframe(self, start_time=None, end_time=None, invert=True, zero_level=ZERO_LEVEL):
+        """
+        Return the records of a time range as a DataFrame in the
+        `all_groups.csv` layout.
+        """
+        rows = records_to_rows(self.time_slice(start_time, end_time), invert, zero_level)
+        df = pd.DataFrame(rows, columns=csv_header())
+        reading_cols = df.columns[1:]
+        df[reading_cols] = df[reading_cols].astype(int)
+        return df
+
+
+def export_csv(record_path, csv_path, invert=True, zero_level=ZERO_LEVEL,
+               chunk_records=CSV_CHUNK_RECORDS):
+    """
+    Export a binary recording to `csv_path` in the `all_groups.csv` layout,
+    processing `chunk_records` records at a time.
+    """
+    records = SessionReader(record_path).records
+    fmt = ['%.3f'] + ['%d'] * (NUM_GROUPS * 4)
+    with open(csv_path, 'w', newline='') as f_out:
+        f_out.write(",".join(csv_header()) + "\n")
+        for start in range(0, len(records), chunk_records):
+            rows = records_to_rows(records[start:start + chunk_records], invert, zero_level)
+            np.savetxt(f_out, rows, fmt=fmt, delimiter=',')
+    print(f"✓ Exported {record_path} → {csv_path}")
@@ -0,0 +1,266 @@
+"""
+stage_cache.py
+==================
+This module provides StageCache, an on-disk, content-addressed cache for
+the outputs of the offline pipeline stages (threshold, low-pass, RMS,
+interleave, and the OD → band-pass → MBLL → CBSI tail).
+
+Every stage output is stored under a key hashed from the key of its input
+and the stage parameters. The raw session is hashed once; the keys of the
+later stages are chained from it, so intermediate data never needs to be
+hashed and the last cached stage of a chain is found without loading the
+earlier ones. Changing e.g. the band-pass settings only changes the key of
+the tail, so the cached interleaved data is reused.
+
+The cache size is capped: when it grows past `max_bytes`, the least
+recently used entries are deleted.
+
+The cache also remembers which key an output file written outside of it
+(e.g. interleaved_output.csv) was produced from, so such a file is only
+rewritten when its content would change. These records stay in the cache
+directory; nothing is written next to the output files.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+DEFAULT_DIRECTORY = ".fnirs_cache"
+DEFAULT_MAX_BYTES = 4 * 1024 ** 3
+CACHE_VERSION = 1   # Bump when a stage changes its output
+
+
+def frame_key(df):
+    """
+    Return a SHA-256 hex digest of the column names, dtypes and values of `df`.
+    """
+    digest = hashlib.sha256()
+    for name in df.columns:
+        values = np.ascontiguousarray(df[name].to_numpy())
+        digest.update(f"{name}:{values.dtype.str}:".encode())
+        digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+class StageCache:
+    """
+    StageCache stores DataFrames (as .npz) and files under content-derived
+    keys in `directory`.
+
+    Parameters:
+      directory (str): Cache directory; created if needed.
+      max_bytes (int): Size cap; least recently used entries are evicted.
+    """
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, stage, input_key, params=None):
+        """
+        Return the key of the output of `stage` applied with `params` to
+        the data identified by `input_key`.
+        """
+        description = json.dumps([CACHE_VERSION, stage, input_key, params or {}],
+                                 sort_keys=True, default=str)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def _touch(self, path):
+        # The modification time is the last-use time for LRU eviction
+        # (atime is unreliable on noatime mounts).
+        os.utime(path, None)
+
+    def _store(self, path, write):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)   # Atomic, so readers never see a partial entry
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def has(self, key, suffix=".npz"):
+        """
+        True if an entry is stored under `key`.
+        """
+        return os.path.exists(self._path(key, suffix))
+
+    def load_frame(self, key):
+        """
+        Return the DataFrame stored under `key`, or None.
+        """
+        path = self._path(key, ".npz")
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                columns = entry['columns'].tolist()
+                df = pd.DataFrame({name: entry[f"c{i}"] for i, name in enumerate(columns)})
+            self._touch(path)
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return df
+
+    def save_frame(self, key, df):
+        """
+        Store `df` under `key`.
+        """
+        arrays = {f"c{i}": df[name].to_numpy() for i, name in enumerate(df.columns)}
+        arrays['columns'] = np.array([str(name) for name in df.columns])
+
+        def write(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **arrays)
+        self._store(self._path(key, ".npz"), write)
+
+    def load_file(self, key, destination):
+        """
+        Copy the file stored under `key` to `destination`. Returns False if
+        there is no such entry.
+        """
+        path = self._path(key, ".file")
+        try:
+            shutil.copyfile(path, destination)
+            self._touch(path)
+        except OSError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def save_file(self, key, source):
+        """
+        Store a copy of the file `source` under `key`.
+        """
+        self._store(self._path(key, ".file"), lambda tmp_path: shutil.copyfile(source, tmp_path))
+
+    def _output_record_path(self, path):
+        name = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()
+        return self._path(name, ".output.json")
+
+    def record_output(self, path, key):
+        """
+        Remember that the file at `path` (outside the cache) holds the data
+        stored under `key`.
+        """
+        st = os.stat(path)
+        record = {'path': os.path.abspath(path), 'key': key,
+                  'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        self._store(self._output_record_path(path),
+                    lambda tmp_path: _write_json(tmp_path, record))
+
+    def output_key(self, path):
+        """
+        Return the key recorded by record_output for `path`, or None if
+        there is none or the file has changed since.
+        """
+        try:
+            with open(self._output_record_path(path)) as f:
+                record = json.load(f)
+            st = os.stat(path)
+        except (OSError, ValueError):
+            return None
+        if (record.get('size'), record.get('mtime_ns')) != (st.st_size, st.st_mtime_ns):
+            return None
+        return record.get('key')
+
+    def size(self):
+        """
+        Return the total size (bytes) of the cached entries.
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith((".npz", ".file")):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue   # Removed by another process
+            entries.append((st.st_mtime_ns, st.st_size, name))
+        return entries
+
+    def evict(self):
+        """
+        Delete least recently used entries until the cache fits in `max_bytes`.
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Delete all cached entries.
+        """
+        for _, _, name in self._entries():
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+def _write_json(path, value):
+    with open(path, "w") as f:
+        json.dump(value, f)
+
+
+def chain_keys(cache, input_key, stages):
+    """
+    Return the keys of the outputs of `stages`, a list of
+    (name, params, function) applied in order to the data `input_key`.
+    """
+    keys = []
+    key = input_key
+    for name, params, _ in stages:
+        key = cache.key(name, key, params)
+        keys.append(key)
+    return keys
+
+
+def run_stages(cache, data, input_key, stages):
+    """
+    Run `stages`, a list of (name, params, function) applied in order to
+    `data` as function(data, **params), resuming after the last stage whose
+    output is in `cache` (which may be None). Every computed output is
+    stored in the cache. Returns (output, computed): the output of the last
+    stage and whether any stage had to be computed.
+    """
+    if cache is None:
+        for _, params, function in stages:
+            data = function(data, **params)
+        return data, True
+
+    keys = chain_keys(cache, input_key, stages)
+    start = 0
+    for index in range(len(stages) - 1, -1, -1):
+        if cache.has(keys[index]):
+            cached = cache.load_frame(keys[index])
+            if cached is not None:
+                data, start = cached, index + 1
+                break
+
+    for index in range(start, len(stages)):
+        _, params, function = stages[index]
+        data = function(data, **params)
+        cache.save_frame(keys[index], data)
+    return data, start < len(stages)
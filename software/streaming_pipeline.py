@@ -0,0 +1,227 @@
+"""
+streaming_pipeline.py
+==================
+This module provides StreamingProcessor, a causal version of the offline
+chain in fNIRS_processing.py (threshold → low-pass → per-emitter-segment
+RMS → mode pairing → OD → band-pass → MBLL → CBSI). Decoded frames go in
+as they arrive and HbO/HbR samples come out as soon as each 660 nm / 940 nm
+pair of emitter segments is complete, so concentrations can be shown while
+the session is still being recorded.
+
+Differences from the offline chain, all required to stay causal:
+  - the low-pass and band-pass filters run forward only (sosfilt with
+    carried state) instead of zero-phase;
+  - the OD reference is the mean intensity of the first `baseline_seconds`
+    (the running mean until then) instead of the session mean;
+  - the CBSI ratio of each sample uses the standard deviations of HbO and
+    HbR up to and including that sample.
+"""
+
+import numpy as np
+from scipy.signal import sosfilt, sosfilt_zi
+from filter_design import butter_sos
+from channel_layout import build_channel_info, pair_reading_indices
+from mbll_operator import apply_mbll, mbll_matrices
+from packet_decoder import FRAME_RATE, NUM_GROUPS, ZERO_LEVEL
+
+MODE_660 = 1   # Emitter status while the 660 nm emitters are on
+MODE_940 = 2   # Emitter status while the 940 nm emitters are on
+NUM_READINGS = NUM_GROUPS * 3   # Short, Long1 and Long2 of every group
+
+
+class StreamingProcessor:
+    """
+    StreamingProcessor turns blocks of decoded frames into hemoglobin
+    concentration changes, keeping all filter, segment and baseline state
+    between calls.
+
+    Parameters:
+      fs (float): Frame rate of the input (Hz).
+      age, sd_short, sd_long, molar_ext_coeff_table: As in process_csv_dataset.
+      lowpass_hz, lowpass_order: Low-pass applied to the raw readings.
+      bp_low, bp_high, bp_order: Band-pass applied to the OD changes.
+      output_rate (float): Rate (Hz) of the concentration samples. Each
+                           segment pair is held for its duration, like the
+                           row padding of interleave_mode_blocks.
+      baseline_seconds (float): Length of the OD reference period.
+      lower_threshold, upper_threshold, zero_level: As in threshold_filter.
+      apply_cbsi (bool): Apply (on-line) CBSI to the MBLL output.
+    """
+    def __init__(self, fs=FRAME_RATE, age=22, sd_short=0.6, sd_long=3.5,
+                 molar_ext_coeff_table='wray', lowpass_hz=1.0, lowpass_order=4,
+                 bp_low=0.05, bp_high=0.1, bp_order=4, output_rate=20.0,
+                 baseline_seconds=60.0, lower_threshold=200, upper_threshold=4000,
+                 zero_level=ZERO_LEVEL, apply_cbsi=True):
+        self.fs = fs
+        self.molar_ext_coeff_table = molar_ext_coeff_table
+        self.output_rate = output_rate
+        self.baseline_seconds = baseline_seconds
+        self.lower_threshold = lower_threshold
+        self.upper_threshold = upper_threshold
+        self.zero_level = zero_level
+        self.apply_cbsi = apply_cbsi
+
+        self.channel_names, self.ch_wls, self.ch_dpfs, self.ch_distances = \
+            build_channel_info(age, sd_short, sd_long)
+        # Gather indices into a (2, NUM_READINGS) array of [660 nm RMS, 940 nm RMS].
+        self._pair_index = pair_reading_indices(self.channel_names, self.ch_wls)
+
+        self._mbll_matrices = mbll_matrices(age, sd_short, sd_long, molar_ext_coeff_table)
+        self._lowpass_sos = butter_sos(lowpass_order, lowpass_hz, fs, btype='low')
+        self._bandpass_sos = butter_sos(bp_order, (bp_low, bp_high), output_rate, btype='band')
+        self.reset()
+
+    def reset(self):
+        """
+        Discard all state, e.g. before starting a new session.
+        """
+        self._lowpass_zi = None
+        self._bandpass_zi = np.zeros((len(self._bandpass_sos), len(self.channel_names), 2))
+        # Emitter segment being accumulated.
+        self._segment_mode = None
+        self._segment_sum_sq = np.zeros(NUM_READINGS)
+        self._segment_count = 0
+        self._pending = None          # Completed 660 nm segment: (rms, count)
+        # OD reference (mean intensity during the baseline period).
+        self._baseline_sum = np.zeros(len(self.channel_names))
+        self._baseline_time = 0.0
+        self._refs = None
+        # Output clock.
+        self._elapsed = 0.0           # Seconds covered by completed pairs
+        self.samples_out = 0
+        # Running statistics for on-line CBSI.
+        num_pairs = len(self.channel_names) // 2
+        self._cbsi_count = 0
+        self._cbsi_mean = np.zeros((2, num_pairs))
+        self._cbsi_m2 = np.zeros((2, num_pairs))
+
+    @property
+    def channel_types(self):
+        """
+        Types ('hbo'/'hbr') of the rows returned by process().
+        """
+        return ['hbo', 'hbr'] * (len(self.channel_names) // 2)
+
+    def process(self, frames):
+        """
+        Process a block of decoded, inverted frames of shape (N, 8, 5)
+        (see packet_decoder.decode_blocks).
+
+        Returns (times, concentrations): `times` (seconds since the first
+        completed pair, shape (M,)) and `concentrations` of shape (48, M),
+        ordered hbo/hbr per channel like process_csv_dataset. M is 0 until
+        a 660 nm / 940 nm segment pair has been completed.
+        """
+        frames = np.asarray(frames)
+        if len(frames) == 0:
+            return self._empty()
+
+        readings = frames[:, :, 1:4].reshape(len(frames), NUM_READINGS).astype(float)
+        readings = np.where((readings < self.lower_threshold) | (readings > self.upper_threshold),
+                            self.zero_level, readings)
+        if self._lowpass_zi is None:
+            # Start the filter in steady state at the first reading.
+            self._lowpass_zi = sosfilt_zi(self._lowpass_sos)[:, :, None] * readings[0]
+        readings, self._lowpass_zi = sosfilt(self._lowpass_sos, readings, axis=0,
+                                             zi=self._lowpass_zi)
+
+        intensities = []
+        for mode, rms, count in self._completed_segments(frames[:, 0, 4], np.square(readings)):
+            if mode == MODE_660:
+                self._pending = (rms, count)
+            elif mode == MODE_940 and self._pending is not None:
+                pending_rms, pending_count = self._pending
+                self._pending = None
+                pair = np.stack((pending_rms, rms))
+                intensities.append((pair[self._pair_index], pending_count + count))
+            else:
+                self._pending = None
+        if not intensities:
+            return self._empty()
+        return self._intensities_to_concentrations(intensities)
+
+    def _completed_segments(self, emitter, squares):
+        """
+        Accumulate the squared readings into the current emitter segment and
+        yield (mode, rms, count) for each segment that ends in this block.
+        """
+        starts = np.flatnonzero(emitter[1:] != emitter[:-1]) + 1
+        if self._segment_mode is not None and emitter[0] != self._segment_mode:
+            starts = np.concatenate(([0], starts))
+        bounds = np.concatenate(([0], starts, [len(emitter)]))
+        sums = np.add.reduceat(squares, bounds[:-1], axis=0)
+        for start, stop, run_sum in zip(bounds[:-1], bounds[1:], sums):
+            if stop == start:
+                # Empty run: the block starts exactly on a transition.
+                continue
+            if start in starts and self._segment_count:
+                yield (self._segment_mode,
+                       np.sqrt(self._segment_sum_sq / self._segment_count),
+                       self._segment_count)
+                self._segment_sum_sq = np.zeros(NUM_READINGS)
+                self._segment_count = 0
+            self._segment_mode = emitter[start]
+            self._segment_sum_sq += run_sum
+            self._segment_count += stop - start
+
+    def _intensities_to_concentrations(self, intensities):
+        # Hold each pair for its duration on the output clock.
+        delta_od = []
+        for intensity, count in intensities:
+            self._elapsed += count / self.fs
+            self._update_baseline(intensity, count / self.fs)
+            num_out = int(self._elapsed * self.output_rate) - self.samples_out
+            if num_out <= 0:
+                continue
+            od = -np.log10(np.absolute(intensity) / self._refs)
+            delta_od.append(np.repeat(od[:, None], num_out, axis=1))
+            self.samples_out += num_out
+        if not delta_od:
+            return self._empty()
+        delta_od = np.concatenate(delta_od, axis=1)
+        first = self.samples_out - delta_od.shape[1]
+        times = np.arange(first, self.samples_out) / self.output_rate
+
+        delta_od, self._bandpass_zi = sosfilt(self._bandpass_sos, delta_od, axis=1,
+                                              zi=self._bandpass_zi)
+        delta_c = apply_mbll(delta_od, self._mbll_matrices)
+        if self.apply_cbsi:
+            delta_c = self._cbsi(delta_c)
+        return times, delta_c
+
+    def _update_baseline(self, intensity, duration):
+        if self._baseline_time >= self.baseline_seconds:
+            return
+        self._baseline_sum += np.absolute(intensity) * duration
+        self._baseline_time += duration
+        self._refs = self._baseline_sum / self._baseline_time
+
+    def _cbsi(self, delta_c):
+        """
+        CBSI (see nirsimple.processing.cbsi) with the alpha of each sample
+        taken from the running standard deviations of HbO and HbR up to and
+        including that sample, so the output does not depend on how the
+        frames were split into blocks.
+        """
+        hbo_hbr = np.stack((delta_c[0::2], delta_c[1::2]))   # (2, channels, M)
+        # Running sums of the block, centred on the mean of the earlier
+        # samples (whose squared deviations sum to the stored M2).
+        count = self._cbsi_count + np.arange(1, hbo_hbr.shape[2] + 1)
+        centred = hbo_hbr - self._cbsi_mean[..., None]
+        sums = np.cumsum(centred, axis=2)
+        m2 = self._cbsi_m2[..., None] + np.cumsum(centred ** 2, axis=2) - sums ** 2 / count
+        self._cbsi_mean = self._cbsi_mean + sums[..., -1] / count[-1]
+        self._cbsi_m2 = m2[..., -1]
+        self._cbsi_count = count[-1]
+
+        std_hbo, std_hbr = np.sqrt(np.maximum(m2, 0) / count)
+        alpha = np.divide(std_hbo, std_hbr, out=np.ones_like(std_hbo), where=std_hbr > 0)
+        alpha[alpha == 0] = 1.0
+        hbo = (hbo_hbr[0] - alpha * hbo_hbr[1]) / 2
+        corrected = np.empty_like(delta_c)
+        corrected[0::2] = hbo
+        corrected[1::2] = -hbo / alpha
+        return corrected
+
+    def _empty(self):
+        return np.empty(0), np.empty((len(self.channel_names), 0))
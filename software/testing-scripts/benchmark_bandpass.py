@@ -0,0 +1,54 @@
+"""
+benchmark_bandpass.py
+==================
+This script times smart_bandpass on a synthetic 48 × N OD matrix (a long
+session at the 500 Hz interleaved rate) with the channels filtered in one
+call and split across thread pools of increasing size, and checks that
+every worker count gives the same result.
+
+Usage:
+  python testing-scripts/benchmark_bandpass.py [minutes] [max workers]
+"""
+
+import os
+import sys
+import time
+import numpy as np
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from fNIRS_processing import smart_bandpass
+
+FS = 500.0        # Sample rate of the interleaved rows
+NUM_CHANNELS = 48
+REPEATS = 3
+
+minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 60.0
+max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+rng = np.random.default_rng(0)
+num_samples = int(minutes * 60 * FS)
+delta_od = rng.standard_normal((NUM_CHANNELS, num_samples)) * 1e-3
+print(f"OD matrix: {NUM_CHANNELS} × {num_samples} ({minutes:g} min at {FS:g} Hz), "
+      f"{os.cpu_count()} CPUs")
+
+worker_counts = [1] + [w for w in (2, 4, 8, 16, 32) if w <= max_workers]
+if max_workers > 1 and max_workers not in worker_counts:
+    worker_counts.append(max_workers)
+
+reference, baseline = None, None
+rows = []
+for workers in worker_counts:
+    smart_bandpass(delta_od[:, :int(FS * 60)], FS, workers=workers)  # Warm up (filter design)
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = smart_bandpass(delta_od, FS, workers=workers)
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    if reference is None:
+        reference, baseline = result, best
+    rows.append([workers, f"{best:.3f}", f"{baseline / best:.2f}×",
+                 np.array_equal(result, reference)])
+
+print(tabulate(rows, headers=["Workers", "Best time (s)", "Speedup", "Identical"]))
@@ -0,0 +1,87 @@
+"""
+test_chunked_processing.py
+==================
+Checks that process_recording_chunked (chunked_processing.py) produces the
+same output as the in-memory process_session (fNIRS_processing.py) on a
+synthetic recording that spans many chunks.
+
+Usage:
+  python -m pytest testing-scripts/test_chunked_processing.py
+  python testing-scripts/test_chunked_processing.py
+"""
+
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from chunked_processing import process_recording_chunked
+from fNIRS_processing import process_session
+from session_recorder import FORMAT_VERSION, HEADER_DTYPE, MAGIC, RECORD_DTYPE, SessionReader
+
+NUM_FRAMES = 120000     # 2 minutes at 1 kHz
+CHUNK_RECORDS = 20000   # Frames per chunk: 6 chunks
+CHUNK_SAMPLES = 500     # Down-sampled samples per band-pass chunk
+REL_TOLERANCE = 1e-9    # Max difference relative to the largest concentration
+
+
+def write_recording(path, num_frames=NUM_FRAMES, seed=0):
+    """
+    Write a synthetic recording: slow oscillations plus noise on every
+    reading, emitter segments of ~4 s alternating between 660 and 940 nm,
+    and a few out-of-range readings.
+    """
+    rng = np.random.default_rng(seed)
+    records = np.zeros(num_frames, dtype=RECORD_DTYPE)
+    records['timestamp'] = np.arange(num_frames) * 0.001 + rng.normal(0, 1e-4, num_frames)
+    groups = records['frame']['groups']
+    groups['group_id'] = 0xF0 + np.arange(8)
+    segment_lengths = rng.integers(3900, 4100, num_frames // 3000 + 2)
+    emitter = np.repeat(np.arange(len(segment_lengths)) % 2 + 1, segment_lengths)[:num_frames]
+    groups['emitter'] = emitter[:, None]
+    t = np.arange(num_frames) / 1000.0
+    for k, field in enumerate(['short', 'long1', 'long2']):
+        signal = (1500 + 200 * np.sin(2 * np.pi * 0.07 * t + k)[:, None]
+                  + 300 * np.sin(2 * np.pi * 0.01 * t)[:, None]
+                  + rng.normal(0, 20, (num_frames, 8)) + 80 * (emitter == 2)[:, None])
+        signal[rng.random((num_frames, 8)) < 1e-4] = 4090
+        groups[field] = np.clip(2 * 2050 - signal, 0, 4095).astype(int)
+
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['version'] = FORMAT_VERSION
+    header['record_size'] = RECORD_DTYPE.itemsize
+    with open(path, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(records.tobytes())
+
+
+def test_chunked_matches_process_session(tmp_path):
+    record_path = os.path.join(tmp_path, "all_groups.bin")
+    write_recording(record_path)
+
+    in_memory_csv = os.path.join(tmp_path, "in_memory.csv")
+    df = SessionReader(record_path).to_dataframe()
+    process_session(df, interleaved_csv=os.path.join(tmp_path, "interleaved_output.csv"),
+                    output_csv=in_memory_csv)
+
+    chunked_csv = os.path.join(tmp_path, "chunked.csv")
+    process_recording_chunked(record_path, chunked_csv, chunk_records=CHUNK_RECORDS,
+                              chunk_samples=CHUNK_SAMPLES, tmp_dir=tmp_path)
+
+    expected = pd.read_csv(in_memory_csv)
+    actual = pd.read_csv(chunked_csv)
+    assert list(actual.columns) == list(expected.columns)
+    assert actual.shape == expected.shape
+    assert (actual['Time'] == expected['Time']).all()
+    values, reference = actual.to_numpy()[:, 1:], expected.to_numpy()[:, 1:]
+    assert np.abs(values - reference).max() <= REL_TOLERANCE * np.abs(reference).max()
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp:
+        test_chunked_matches_process_session(tmp)
+    print("Chunked output matches process_session.")
@@ -0,0 +1,64 @@
+"""
+test_streaming_pipeline.py
+==================
+Checks that StreamingProcessor (streaming_pipeline.py) returns the same
+concentrations whether a recording is fed in one call or in the small
+blocks of separate serial reads.
+
+Usage:
+  python -m pytest testing-scripts/test_streaming_pipeline.py
+  python testing-scripts/test_streaming_pipeline.py
+"""
+
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from streaming_pipeline import StreamingProcessor
+
+NUM_FRAMES = 60000      # 1 minute at 1 kHz
+BLOCK_FRAMES = 137      # Frames per serial read
+REL_TOLERANCE = 1e-9    # Max difference relative to the largest concentration
+
+
+def make_frames(num_frames=NUM_FRAMES, seed=0):
+    """
+    Return decoded frames (N, 8, 5): slow oscillations plus noise on every
+    reading and emitter segments of ~1 s alternating between 660 and 940 nm.
+    """
+    rng = np.random.default_rng(seed)
+    frames = np.zeros((num_frames, 8, 5), dtype=int)
+    frames[:, :, 0] = 0xF0 + np.arange(8)
+    segment_lengths = rng.integers(900, 1100, num_frames // 900 + 2)
+    emitter = np.repeat(np.arange(len(segment_lengths)) % 2 + 1, segment_lengths)[:num_frames]
+    frames[:, :, 4] = emitter[:, None]
+    t = np.arange(num_frames) / 1000.0
+    for k in range(3):
+        signal = (1500 + 200 * np.sin(2 * np.pi * 0.07 * t + k)[:, None]
+                  + 300 * np.sin(2 * np.pi * 0.01 * t)[:, None]
+                  + rng.normal(0, 20, (num_frames, 8)) + 80 * (emitter == 2)[:, None])
+        frames[:, :, k + 1] = np.clip(signal, 0, 4095).astype(int)
+    return frames
+
+
+def test_output_does_not_depend_on_blocks():
+    frames = make_frames()
+    whole_times, whole = StreamingProcessor().process(frames)
+
+    processor = StreamingProcessor()
+    results = [processor.process(frames[start:start + BLOCK_FRAMES])
+               for start in range(0, len(frames), BLOCK_FRAMES)]
+    times = np.concatenate([r[0] for r in results])
+    blocks = np.concatenate([r[1] for r in results], axis=1)
+
+    assert whole.shape[1] > 0
+    assert blocks.shape == whole.shape
+    assert np.allclose(times, whole_times)
+    assert np.abs(blocks - whole).max() <= REL_TOLERANCE * np.abs(whole).max()
+
+
+if __name__ == '__main__':
+    test_output_does_not_depend_on_blocks()
+    print("Streaming output does not depend on the block size.")
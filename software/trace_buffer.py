@@ -0,0 +1,99 @@
+"""
+trace_buffer.py
+==================
+This module provides TraceBuffer, a fixed-size store for the live plot
+traces (sensor groups × channels × samples). It replaces per-trace Python
+lists and deques: appends are O(1), blocks of samples are appended with
+slice assignment, and the latest samples of every trace are available as
+contiguous NumPy views. Views are overwritten by later appends, so copy
+the window (see decimation.py) before handing it to PlotDataItem.setData,
+which keeps a reference to its input.
+"""
+
+import numpy as np
+
+
+class TraceBuffer:
+    """
+    TraceBuffer keeps the last `capacity` samples of each (group, channel)
+    trace in a preallocated array. Every sample is written twice, at the
+    cursor and at cursor + capacity, so the most recent window is always
+    one contiguous slice and reading it needs no copy. Memory stays
+    fixed regardless of how long the session runs.
+    """
+    def __init__(self, num_groups, num_channels, capacity, dtype=np.float32):
+        self.num_groups = num_groups
+        self.num_channels = num_channels
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self._data = np.zeros((num_groups, num_channels, 2 * capacity), dtype=dtype)
+        self._cursor = 0   # Next write position in [0, capacity)
+        self._count = 0    # Number of valid samples (<= capacity)
+        self.version = 0   # Incremented on every change, used as a dirty flag
+        self.total_samples = 0  # Samples appended since creation (never reset)
+
+    def __len__(self):
+        return self._count
+
+    def append(self, sample):
+        """
+        Append one sample of shape (num_groups, num_channels).
+        """
+        cursor = self._cursor
+        self._data[:, :, cursor] = sample
+        self._data[:, :, cursor + self.capacity] = sample
+        self._cursor = (cursor + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+        self.total_samples += 1
+        self.version += 1
+
+    def extend(self, samples):
+        """
+        Append a block of samples of shape (N, num_groups, num_channels).
+        Only the last `capacity` samples of a larger block are kept.
+        """
+        samples = np.asarray(samples)
+        num_samples = len(samples)
+        if num_samples == 0:
+            return
+        if num_samples > self.capacity:
+            samples = samples[-self.capacity:]
+        # (N, groups, channels) -> (groups, channels, N)
+        block = np.moveaxis(samples, 0, -1)
+        size = block.shape[-1]
+
+        cursor = self._cursor
+        first = min(size, self.capacity - cursor)
+        self._data[:, :, cursor:cursor + first] = block[..., :first]
+        self._data[:, :, cursor + self.capacity:cursor + self.capacity + first] = block[..., :first]
+        rest = size - first
+        if rest:
+            self._data[:, :, :rest] = block[..., first:]
+            self._data[:, :, self.capacity:self.capacity + rest] = block[..., first:]
+
+        self._cursor = (cursor + size) % self.capacity
+        self._count = min(self._count + num_samples, self.capacity)
+        self.total_samples += num_samples
+        self.version += 1
+
+    def view(self):
+        """
+        Return a (num_groups, num_channels, len(self)) view of the stored
+        samples, oldest first. The view is only valid until the next append.
+        """
+        end = self._cursor + self.capacity
+        return self._data[:, :, end - self._count:end]
+
+    def trace(self, group, channel):
+        """
+        Return a contiguous 1-D view of one trace, oldest sample first.
+        """
+        return self.view()[group, channel]
+
+    def clear(self):
+        """
+        Discard all stored samples.
+        """
+        self._cursor = 0
+        self._count = 0
+        self.version += 1
@@ -15,6 +15,7 @@ import time
 import os
 import logging
 import subprocess
+from functools import lru_cache
 import threading
 from queue import Queue
 
@@ -25,13 +26,14 @@ import plotly.graph_objs as go
 from plotly.offline import plot
 import numpy as np
 import nibabel as nib
-from scipy.spatial import cKDTree
 import socketio as sio_client_lib
 import pandas as pd
 
 import eventlet
 eventlet.monkey_patch()
 import config
+from geometry_cache import geometry_key, load_geometry, save_geometry
+from mesh_index import MeshIndex
 
 # Check command-line arguments for a demo flag.
 demo_mode = any(arg.lower() == 'demo' for arg in sys.argv[1:])
@@ -120,18 +122,38 @@ signal.signal(signal.SIGINT, signal_handler)
 # -----------------------------------------------------
 # fNIRS Data Processing and Brain Mesh Functions
 # -----------------------------------------------------
-def compute_vertex_normals(vertices, triangles):
-    """Compute an approximate normal for each vertex in the mesh."""
+# Brain mesh intensity: 0 (inactive) is lightpink; activated regions go from
+# salmon to red as their mean hbo magnitude approaches the largest one.
+ACTIVATION_COLORSCALE = [[0, 'lightpink'], [0.01, 'salmon'], [1, 'red']]
+ACTIVE_MIN_INTENSITY = 0.05   # Least intensity of an activated region, relative to the largest
+MESH_FILE = 'BrainMesh_Ch2_smoothed.nv'
+AAL_FILE = 'aal.nii'
+REGION_THRESHOLD = 2.0   # Max distance (mm) of region points from the brain surface
+
+def compute_vertex_normals(vertices, triangles, weighting='unit'):
+    """
+    Compute an approximate normal for each vertex in the mesh: the
+    normalized sum of the normals of the triangles around it.
+
+    Parameters:
+      vertices (ndarray): (N, 3) vertex coordinates.
+      triangles (ndarray): (M, 3) vertex indices of each triangle.
+      weighting (str): 'unit' gives every triangle the same weight,
+                       'area' weights each triangle by its area.
+    """
+    if weighting not in ('unit', 'area'):
+        raise ValueError(f"Unknown weighting '{weighting}', expected 'unit' or 'area'.")
+    vertices = np.asarray(vertices, dtype=float)
+    triangles = np.asarray(triangles, dtype=np.intp)
+    v0, v1, v2 = (vertices[triangles[:, n]] for n in range(3))
+    # The cross product's length is twice the triangle area.
+    face_normals = np.cross(v1 - v0, v2 - v0)
+    if weighting == 'unit':
+        lengths = np.linalg.norm(face_normals, axis=1, keepdims=True)
+        face_normals = np.divide(face_normals, lengths, out=face_normals, where=lengths > 0)
     normals = np.zeros(vertices.shape, dtype=float)
-    for tri in triangles:
-        v0, v1, v2 = vertices[tri[0]], vertices[tri[1]], vertices[tri[2]]
-        n = np.cross(v1 - v0, v2 - v0)
-        norm = np.linalg.norm(n)
-        if norm:
-            n = n / norm
-        normals[tri[0]] += n
-        normals[tri[1]] += n
-        normals[tri[2]] += n
+    for n in range(3):
+        np.add.at(normals, triangles[:, n], face_normals)
     norms = np.linalg.norm(normals, axis=1)[:, None]
     normals = normals / (norms + 1e-8)
     return normals
@@ -194,17 +216,27 @@ def preload_static_data():
     """
     Load brain mesh data from file.
     """
-    coords = np.loadtxt('BrainMesh_Ch2_smoothed.nv', skiprows=1, max_rows=53469)
+    coords = np.loadtxt(MESH_FILE, skiprows=1, max_rows=53469)
     x, y, z = coords.T
-    triangles = np.loadtxt('BrainMesh_Ch2_smoothed.nv', skiprows=53471, dtype=int)
+    triangles = np.loadtxt(MESH_FILE, skiprows=53471, dtype=int)
     triangles_zero_offset = triangles - 1
     i, j, k = triangles_zero_offset.T
-    aal_img = nib.load('aal.nii')
+    aal_img = nib.load(AAL_FILE)
     aal_data = aal_img.get_fdata()
     affine = aal_img.affine
     return coords, x, y, z, i, j, k, aal_data, affine
 
-def initialize_sensor_positions(coords):
+@lru_cache(maxsize=1)
+def load_brain_mesh():
+    """
+    Return preload_static_data() and the MeshIndex of the mesh vertices,
+    loaded on first use and kept for the process, so computing the geometry
+    of a new sensor layout neither re-reads the files nor rebuilds the index.
+    """
+    static_data = preload_static_data()
+    return static_data, MeshIndex(static_data[0])
+
+def initialize_sensor_positions():
     """
     Define custom sensor positions, assign each a node type and rotation angle.
     Returns separate arrays for emitters and detectors.
@@ -269,13 +301,59 @@ def map_points_to_regions(points, affine, aal_data):
             regions.append(-1)
     return np.array(regions)
 
-def filter_coordinates_to_surface(coords, surface_coords, threshold=2.0):
+def compute_static_geometry(sensor_positions, sensor_mapping, threshold=REGION_THRESHOLD):
+    """
+    Compute the brain geometry from the mesh and AAL files for the sensors at
+    `sensor_positions`. Returns a dict of arrays: the mesh `vertices`,
+    `triangles` and vertex `normals`, the AAL `sensor_region` of each hbo
+    sensor (`sensor_mapping` gives its position), the `region_ids` of the
+    sensor regions, the `vertex_region` labels (the index into `region_ids`
+    of the region nearest to each vertex, len(region_ids) for vertices
+    farther than `threshold`) and the `sensor_vertices`, the mesh vertex
+    nearest to each sensor position.
+    """
+    (coords, _, _, _, i, j, k, aal_data, affine), index = load_brain_mesh()
+    triangles = np.column_stack((i, j, k))
+    regions = map_points_to_regions(sensor_positions, affine, aal_data)
+    sensor_region = regions[sensor_mapping]
+
+    # Get the unique region IDs from the sensors (only those > 0) and keep
+    # their points close to the brain surface, all regions in one pass.
+    region_ids = np.unique(sensor_region[sensor_region > 0])
+    region_voxels = np.argwhere(np.isin(aal_data, region_ids))
+    voxel_regions = aal_data[tuple(region_voxels.T)]
+    region_world_coords = [nib.affines.apply_affine(affine, region_voxels[voxel_regions == reg])
+                           for reg in region_ids]
+    # All surface lookups share the mesh index; warm starts load the results.
+    region_points = index.filter_near_surface(region_world_coords, threshold)
+    _, sensor_vertices = index.nearest(sensor_positions)
+
+    return {
+        'vertices': coords,
+        'triangles': triangles,
+        'normals': compute_vertex_normals(coords, triangles),
+        'sensor_region': sensor_region,
+        'region_ids': region_ids,
+        'vertex_region': index.label_vertices(region_points, threshold),
+        'sensor_vertices': sensor_vertices,
+    }
+
+def load_static_geometry(sensor_positions, sensor_mapping, threshold=REGION_THRESHOLD):
     """
-    Filter coordinates that are close to the brain surface.
+    Return compute_static_geometry(...), from the geometry cache when the
+    mesh and AAL files and the sensor layout are unchanged.
     """
-    tree = cKDTree(surface_coords)
-    distances, _ = tree.query(coords)
-    return coords[distances <= threshold]
+    key = geometry_key([MESH_FILE, AAL_FILE], {
+        'sensor_positions': sensor_positions,
+        'sensor_mapping': sensor_mapping,
+        'threshold': threshold,
+    })
+    geometry = load_geometry(key)
+    if geometry is None:
+        logging.info("Computing the brain geometry (not cached).")
+        geometry = compute_static_geometry(sensor_positions, sensor_mapping, threshold)
+        save_geometry(key, geometry)
+    return geometry
 
 def create_static_brain_mesh():
     """
@@ -284,24 +362,27 @@ def create_static_brain_mesh():
     """
     fig = go.Figure()
 
-    # Add the brain mesh.
+    # Add the brain mesh. Activated regions are shown through the per-vertex
+    # intensity (0 = inactive, else the region's mean hbo magnitude), set by
+    # the browser on 'brain_activation' updates.
     fig.add_trace(go.Mesh3d(
         x=x, y=y, z=z,
         i=i, j=j, k=k,
-        color='lightpink',
+        intensity=np.zeros(len(x), dtype=np.float32),
+        intensitymode='vertex',
+        colorscale=ACTIVATION_COLORSCALE,
+        cmin=0,
+        cmax=1,
         opacity=0.5,
         name='Brain Mesh',
         showscale=False
     ))
 
-    # Build KD-tree and compute vertex normals.
-    vertices = np.column_stack((x, y, z))
-    triangles = np.column_stack((i, j, k))
-    vertex_normals = compute_vertex_normals(vertices, triangles)
-    tree = cKDTree(vertices)
+    # Orient the sensors along the normal of their nearest vertex (cached,
+    # see compute_static_geometry).
+    emitter_indices, detector_indices = np.split(sensor_vertices, [len(emitter_positions)])
 
     # Plot Emitters.
-    _, emitter_indices = tree.query(emitter_positions)
     emitter_normals = vertex_normals[emitter_indices]
     for pos, angle, norm in zip(emitter_positions, emitter_angles, emitter_normals):
         vertices_cap, faces_cap = create_flat_cylinder_mesh(pos,
@@ -323,7 +404,6 @@ def create_static_brain_mesh():
         ))
 
     # Plot Detectors.
-    _, detector_indices = tree.query(detector_positions)
     detector_normals = vertex_normals[detector_indices]
     for pos, angle, norm in zip(detector_positions, detector_angles, detector_normals):
         vertices_cap, faces_cap = create_flat_cylinder_mesh(pos,
@@ -358,12 +438,10 @@ def create_static_brain_mesh():
 # Global Variables
 # -----------------------------------------------------
 
-# Preload data.
-coords, x, y, z, i, j, k, aal_data, affine = preload_static_data()
-emitter_positions, emitter_angles, detector_positions,detector_angles = initialize_sensor_positions(coords)
+# Sensor layout.
+(emitter_positions, emitter_angles,
+ detector_positions, detector_angles) = initialize_sensor_positions()
 combined_positions = np.vstack((emitter_positions, detector_positions))
-regions = map_points_to_regions(combined_positions, affine, aal_data)
-brain_mesh_fig = create_static_brain_mesh()
 emitter_states = [True] * len(emitter_positions)
 
 # Global variable to store accumulated activation data
@@ -412,78 +490,57 @@ sensor_mapping = [
 # Precomputation for Region Mappings
 # -----------------------------------------------------
 
-# Precompute sensor-to-region mapping (length 24)
-sensor_region = [regions[sensor_mapping[i]] for i in range(len(sensor_mapping))]
-
-# Precompute region-to-sensor indices for regions of interest.
-region_to_sensor_indices = {}
-for i, reg in enumerate(sensor_region):
-    if reg > 0:
-        region_to_sensor_indices.setdefault(reg, []).append(i)
-
-# Precompute filtered coordinates for each region (using a constant threshold, e.g., 2.0)
-surface_coords = np.column_stack((x, y, z))
-region_filtered = {}
-# Get the unique region IDs from the sensors (only those > 0)
-unique_sensor_regions = np.unique([r for r in sensor_region if r > 0])
-for reg in unique_sensor_regions:
-    region_mask = aal_data == reg
-    region_voxels = np.argwhere(region_mask)
-    region_world_coords = nib.affines.apply_affine(affine, region_voxels)
-    filtered_coords = filter_coordinates_to_surface(region_world_coords,
-                                                    surface_coords,
-                                                    threshold=2.0)
-    region_filtered[reg] = filtered_coords
+# Preload the mesh and region geometry (cached on disk, see geometry_cache.py).
+geometry = load_static_geometry(combined_positions, sensor_mapping)
+x, y, z = geometry['vertices'].T
+i, j, k = geometry['triangles'].T
+vertex_normals = geometry['normals']
+sensor_vertices = geometry['sensor_vertices']
+brain_mesh_fig = create_static_brain_mesh()
+
+# Sensor-to-region mapping (length 24)
+sensor_region = list(geometry['sensor_region'])
+
+# AAL regions holding a sensor (only those > 0).
+unique_sensor_regions = geometry['region_ids']
+
+# Region label of every mesh vertex, as an index into unique_sensor_regions
+# (len(unique_sensor_regions) for vertices outside all sensor regions), and
+# the same index for every sensor.
+vertex_region = geometry['vertex_region']
+sensor_region_index = np.searchsorted(unique_sensor_regions, sensor_region).astype(np.intp)
+sensor_region_index[~np.isin(sensor_region, unique_sensor_regions)] = len(unique_sensor_regions)
 
 
 # -----------------------------------------------------
 # Helper Functions for Updating the Brain Mesh
 # -----------------------------------------------------
-def update_highlighted_regions(fig, hbo_values):
-    """
-    Update the brain mesh with highlighted regions based on activation data.
-    Uses precomputed sensor-to-region mapping, region-to-sensor indices, and
-    precomputed filtered coordinates.
-    """
-    # Collect region IDs from sensors that are activated (hbo value < 0)
-    highlighted_region_ids = []
-    for i, value in enumerate(hbo_values):
-        if value < 0 and sensor_region[i] > 0:
-            highlighted_region_ids.append(sensor_region[i])
-    highlighted_region_ids = np.unique(highlighted_region_ids)
-
-    highlighted_coords = []
-    highlighted_values = []
-    for reg in highlighted_region_ids:
-        filtered_coords = region_filtered.get(reg)
-        if filtered_coords is not None and filtered_coords.size > 0:
-            # Compute average sensor value from the sensors mapping to this region.
-            indices = region_to_sensor_indices.get(reg, [])
-            if indices:
-                avg_val = np.mean([hbo_values[i] for i in indices])
-            else:
-                avg_val = 0
-            highlighted_coords.append(filtered_coords)
-            highlighted_values.extend([avg_val] * len(filtered_coords))
-
-    if highlighted_coords:
-        highlighted_coords = np.vstack(highlighted_coords)
-        highlighted_values = np.array(highlighted_values)
-        # Remove old highlight traces and add new trace.
-        fig.data = [trace for trace in fig.data if trace.name != 'Highlighted Regions']
-        fig.add_trace(go.Scatter3d(
-            x=highlighted_coords[:, 0],
-            y=highlighted_coords[:, 1],
-            z=highlighted_coords[:, 2],
-            mode='markers',
-            marker=dict(
-                size=2,
-                color='red',
-                opacity=0.1
-            ),
-            name='Highlighted Regions'
-        ))
-    return fig
+def vertex_activation(hbo_values):
+    """
+    Return the activation intensity (float32, one per mesh vertex) for the
+    latest activation data: on the vertices of the regions holding a sensor
+    with an hbo value < 0, the magnitude of the average hbo value of the
+    sensors mapping to the region, at least ACTIVE_MIN_INTENSITY times the
+    largest one (or 1 if all are 0) so no activated region looks inactive;
+    0 elsewhere.
+    Uses the precomputed sensor and vertex region labels.
+    """
+    # One value per sensor, as a (24,) or (24, 1) array (one packet).
+    hbo_values = np.asarray(hbo_values, dtype=float)
+    if hbo_values.size != len(sensor_region_index):
+        raise ValueError(f"Expected one hbo value per sensor, got shape {hbo_values.shape}.")
+    hbo_values = hbo_values.ravel()
+    num_regions = len(unique_sensor_regions)
+    counts = np.bincount(sensor_region_index, minlength=num_regions + 1)
+    sums = np.bincount(sensor_region_index, weights=hbo_values, minlength=num_regions + 1)
+    active = np.bincount(sensor_region_index[hbo_values < 0], minlength=num_regions + 1) > 0
+    active[num_regions] = False  # Vertices and sensors outside all regions
+    region_intensity = np.zeros(num_regions + 1, dtype=np.float32)
+    region_intensity[active] = np.abs(sums[active] / counts[active])
+    peak = region_intensity.max()
+    region_intensity[active] = np.maximum(region_intensity[active],
+                                          ACTIVE_MIN_INTENSITY * peak if peak > 0 else 1.0)
+    return region_intensity[vertex_region]
 
 
 def highlight_sensor_group(fig, group_id):
@@ -545,7 +602,6 @@ def update_graphs(latest_packet):
     Update the brain mesh with new data from the latest packet.
     This function is called when new data is received from the upstream server.
     """
-    global brain_mesh_fig
     if latest_packet is None:
         return
 
@@ -555,10 +611,10 @@ def update_graphs(latest_packet):
         activation_data = activation_data.reshape(-1, 1)
     hbo_values = activation_data[::2]  # Now an array of 24 values
 
-    brain_mesh_fig = update_highlighted_regions(brain_mesh_fig, hbo_values)
-    socketio.emit('brain_mesh_update', {
-        'brain_mesh': brain_mesh_fig.to_json()
-    })
+    # The browser already holds the mesh (/update_graphs): only send the
+    # per-vertex intensity, as a binary attachment.
+    intensity = vertex_activation(hbo_values)
+    socketio.emit('brain_activation', {'intensity': intensity.tobytes()})
 
 
 def stop_serial_reader():
@@ -588,6 +644,25 @@ def reinit_serial_connection():
         logging.error(f"Error reinitializing serial port: {e}")
 
 
+# -------------------- Socket.IO Server Events --------------------
+
+@socketio.on('live_concentrations')
+def live_concentrations(data):
+    """
+    Receives the live concentrations that fNIRS_processing.py streams while
+    recording (when started with the 'stream' flag): data['concentrations']
+    holds the latest hbo/hbr sample of the 24 channels. Updates the brain
+    mesh while in record mode; ignored otherwise.
+    """
+    if current_mode != 'record':
+        return
+    activation_data = np.asarray(data.get('concentrations', []), dtype=float)
+    if activation_data.size != 48:
+        logging.warning(f"Ignoring live concentrations of size {activation_data.size}.")
+        return
+    update_graphs(activation_data)
+
+
 # -------------------- Flask Routes --------------------
 
 @app.route('/')
@@ -680,7 +755,8 @@ def start_processing():
             # Stop the visualizer's serial reading
             stop_serial_reader()
             # Now launch fnirs_processing.py which creates its own serial connection.
-            proc = subprocess.Popen(['python', 'fNIRS_processing.py'])
+            # 'stream': send live concentrations to this server (live_concentrations).
+            proc = subprocess.Popen(['python', 'fNIRS_processing.py', 'stream'])
             running_processes.extend([proc])
             return jsonify({'status': 'processing started'})
         except Exception as e: